@@ -0,0 +1,731 @@
+#!/usr/bin/env python3
+"""
+Mermaid Formatter Benchmarks
+
+Generates a deterministic synthetic corpus and measures the throughput of
+format-mermaid.py: MermaidParser.parse, MermaidFormatter.format,
+MarkdownProcessor.process_file and an end-to-end CLI run. Results can be
+saved as a baseline and later runs compared against it. With --scaling,
+it instead times parsing and formatting single diagrams of growing size
+and checks that the time per element of each stage stays flat; with
+--scaling diagrams, it does the same for process_file on one page with a
+growing number of diagrams. With --memory, it measures with tracemalloc
+the memory a parsed large diagram holds, optionally against the formatter
+at another git revision. With --server, it drives format-mermaid.py
+--server with a scripted editor client and compares its per-request
+latency with spawning the script for each buffer.
+
+Usage:
+    python bench-mermaid.py [options]
+
+Options:
+    --profile NAME      Corpus: small, large or sparse (default: small)
+    --files N, --diagrams N, --nodes N, --edges N, --depth N, --comments F,
+    --plain F, --huge N
+                        Override the profile's corpus parameters
+    --seed N            Random seed for the corpus (default: 1)
+    --repeat N          Timed repetitions; the fastest is reported (default: 3)
+    --corpus-dir DIR    Write the corpus here and keep it (default: temp dir)
+    --baseline FILE     Baseline file (default: .cache/format-mermaid/bench-baseline.json)
+    --save-baseline     Store this run as the baseline for the profile
+    --threshold PCT     Regression threshold in percent (default: 10)
+    --scaling [KIND]    Time parse, graph index and format on one diagram
+                        at each of --sizes elements instead (KIND elements,
+                        the default), or process_file on one page holding
+                        --sizes diagrams (KIND diagrams)
+    --sizes N,N,...     Sizes for --scaling (default: 1000,10000,100000
+                        elements or 100,200,400,800 diagrams)
+    --max-growth X      Allowed growth in time per element (or diagram) from
+                        the smallest to the largest size (default: 2.0)
+    --memory            Measure the parse tree of one flowchart of --edges
+                        connections and --nodes nodes (default: 50000 and
+                        8000) instead
+    --against REV       With --memory, also measure the formatter at this
+                        git revision; fails if the working tree needs more
+                        than --threshold percent more memory
+    --server            Send each corpus page to format-mermaid.py --server
+                        and time the requests against spawning the script
+                        per page instead
+"""
+
+import argparse
+import importlib.util
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+FORMATTER = Path(__file__).resolve().parent / 'format-mermaid.py'
+MODULE = FORMATTER.parent / 'format_mermaid.py'
+
+DEFAULT_BASELINE = '.cache/format-mermaid/bench-baseline.json'
+DEFAULT_THRESHOLD = 10.0
+
+DEFAULT_SIZES = {'elements': '1000,10000,100000', 'diagrams': '100,200,400,800'}
+DEFAULT_MAX_GROWTH = 2.0
+
+# Lines of prose between the diagrams of the --scaling diagrams page
+FILLER_LINES = 400
+
+# Shape of the --memory flowchart, like an auto-generated dependency graph
+MEMORY_EDGES = 50000
+MEMORY_NODES = 8000
+
+
+# =============================================================================
+# Corpus Generator
+# =============================================================================
+
+@dataclass
+class CorpusParams:
+    """Shape of a synthetic corpus."""
+    files: int
+    diagrams: int       # Diagrams per file
+    nodes: int          # Node definitions per diagram
+    edges: int          # Connections per diagram
+    depth: int          # Maximum subgraph nesting depth
+    comments: float     # Probability of a comment before each statement
+    plain: float = 0.0  # Fraction of files with prose and code but no diagrams
+    huge: int = 0       # Files padded with prose past HUGE_PAGE_BYTES, diagrams last
+
+
+PROFILES = {
+    'small': CorpusParams(files=50, diagrams=2, nodes=30, edges=40, depth=2, comments=0.1),
+    'large': CorpusParams(files=1000, diagrams=4, nodes=150, edges=250, depth=3, comments=0.1),
+    # Like this site: most pages have no diagrams at all, plus one generated
+    # reference page big enough for the prefilter to search it through mmap
+    'sparse': CorpusParams(files=2000, diagrams=2, nodes=30, edges=40, depth=2, comments=0.1,
+                           plain=0.85, huge=1),
+}
+
+# Above the formatter's PREFILTER_MMAP_SIZE of 1 MB
+HUGE_PAGE_BYTES = 1200 * 1024
+
+LABEL_WORDS = ['Install', 'Configure', 'Cluster', 'Upgrade', 'Node', 'Proxy', 'Image',
+               'Release Notes', 'Concepts', 'CLI', 'Backup', 'Restore']
+
+ARROWS = ['-->', '-->', '-->', '<-->', '-.->']
+
+
+def generate_diagram(rng: random.Random, params: CorpusParams) -> List[str]:
+    """Generate one flowchart with deliberately inconsistent formatting."""
+    def indent() -> str:
+        return rng.choice(['', '  ', '    ', '\t'])
+
+    def label() -> str:
+        return ' '.join(rng.sample(LABEL_WORDS, 2))
+
+    def comment():
+        if rng.random() < params.comments:
+            lines.append(f"{indent()}%% {label()}")
+
+    node_ids = [f"W{i}" if i % 10 == 0 else f"N{i}" for i in range(params.nodes)]
+    lines = [rng.choice(['flowchart TB', 'flowchart LR', 'graph TD'])]
+    depth = 0
+    for i, node_id in enumerate(node_ids):
+        if depth < params.depth and rng.random() < 0.05:
+            name = 'Workflow' if rng.random() < 0.3 else 'Group'
+            lines.append(f'{indent()}subgraph {name}{i}["{label()}"]')
+            depth += 1
+        elif depth and rng.random() < 0.05:
+            lines.append(f"{indent()}end")
+            depth -= 1
+        comment()
+        shape = rng.random()
+        if shape < 0.6:
+            lines.append(f'{indent()}{node_id}["{label()}"]')
+        elif shape < 0.8:
+            lines.append(f'{indent()}{node_id}[{label()}]')
+        elif shape < 0.9:
+            lines.append(f'{indent()}{node_id}(["{label()}"])')
+        else:
+            lines.append(f'{indent()}{node_id}[/"{label()}"/]')
+    lines.extend(f"{indent()}end" for _ in range(depth))
+
+    for _ in range(params.edges):
+        comment()
+        source, target = rng.choice(node_ids), rng.choice(node_ids)
+        kind = rng.random()
+        if kind < 0.1:
+            lines.append(f'{indent()}{source} -->|"{label()}"| {target}')
+        elif kind < 0.2:
+            lines.append(f'{indent()}{source} -. "{label()}" .- {target}')
+        else:
+            lines.append(f'{indent()}{source} {rng.choice(ARROWS)} {target}')
+
+    lines.append(f"{indent()}classDef custom fill:#eee,stroke:#333")
+    lines.append(f"{indent()}class {','.join(node_ids[:5])} custom")
+    lines.append(f"{indent()}linkStyle 0 stroke:#333")
+    return lines
+
+
+def generate_page(rng: random.Random) -> List[str]:
+    """Generate a page of prose and non-mermaid code blocks."""
+    parts = []
+    for section in range(rng.randint(3, 8)):
+        parts.append(f"\n## {' '.join(rng.sample(LABEL_WORDS, 2))}\n\n")
+        for _ in range(rng.randint(2, 6)):
+            words = rng.choices(LABEL_WORDS, k=rng.randint(20, 60))
+            parts.append(' '.join(words).capitalize() + '.\n\n')
+        if rng.random() < 0.5:
+            parts.append('```bash\nolcnectl module create --environment-name myenvironment\n```\n')
+    return parts
+
+
+def generate_corpus(directory: Path, params: CorpusParams, seed: int) -> Dict[str, int]:
+    """Write a deterministic corpus to directory and return its size."""
+    rng = random.Random(seed)
+    stats = {'files': 0, 'diagrams': 0, 'diagram_lines': 0, 'bytes': 0}
+    for i in range(params.files):
+        parts = [f"---\ntitle: Page {i}\n---\n\n# Page {i}\n"]
+        if i < params.huge:
+            size = 0
+            while size < HUGE_PAGE_BYTES:
+                page = generate_page(rng)
+                parts.extend(page)
+                size += sum(len(part) for part in page)
+            diagrams = params.diagrams
+        elif rng.random() < params.plain:
+            parts.extend(generate_page(rng))
+            diagrams = 0
+        else:
+            diagrams = params.diagrams
+        for _ in range(diagrams):
+            parts.append("\nSome introductory text for the next diagram.\n\n")
+            lines = generate_diagram(rng, params)
+            parts.append('```mermaid\n' + '\n'.join(lines) + '\n```\n')
+            stats['diagrams'] += 1
+            stats['diagram_lines'] += len(lines)
+        text = ''.join(parts)
+        subdir = directory / f"section{i % 10}"
+        subdir.mkdir(parents=True, exist_ok=True)
+        (subdir / f"page{i}.md").write_text(text, encoding='utf-8')
+        stats['files'] += 1
+        stats['bytes'] += len(text.encode('utf-8'))
+    return stats
+
+
+# =============================================================================
+# Measurements
+# =============================================================================
+
+def load_formatter(path: Path = MODULE, name: str = 'format_mermaid'):
+    """Import the formatter module, format_mermaid.py by default."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def revision_source(revision: str) -> bytes:
+    """The source of the formatter module as of a git revision.
+
+    Revisions from before format_mermaid.py was split out have the whole
+    formatter in format-mermaid.py.
+    """
+    try:
+        return subprocess.run(['git', 'show', f'{revision}:./{MODULE.name}'],
+                              cwd=MODULE.parent, capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError:
+        return subprocess.run(['git', 'show', f'{revision}:./{FORMATTER.name}'],
+                              cwd=FORMATTER.parent, capture_output=True, check=True).stdout
+
+
+def best_time(func: Callable[[], object], repeat: int) -> float:
+    """Fastest of repeat calls to func, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmarks(corpus: Path, repeat: int) -> Dict[str, float]:
+    """Time each stage over the corpus; returns seconds per stage."""
+    fm = load_formatter()
+    files = fm.find_markdown_files([str(corpus)])
+    processor = fm.MarkdownProcessor(memo_size=0)
+    blocks = [(block, path) for path in files
+              for block in processor.find_mermaid_blocks(path.read_text(encoding='utf-8'))]
+
+    parser = fm.MermaidParser()
+    formatter = fm.MermaidFormatter()
+    diagrams = [parser.parse(block.content, path) for block, path in blocks]
+
+    timings = {
+        'parse': best_time(lambda: [parser.parse(b.content, p) for b, p in blocks], repeat),
+        'format': best_time(lambda: [formatter.format(d) for d in diagrams], repeat),
+        'process_file': best_time(
+            lambda: [fm.MarkdownProcessor(memo_size=0).process_file(f) for f in files], repeat),
+    }
+    cli = [sys.executable, str(FORMATTER), '--validate', '--no-cache', str(corpus)]
+    # The CLI skips files its prefilter rules out; a prefilter that misses
+    # real diagrams would just look fast. Without read-ahead, files of 1 MB
+    # or more are searched through mmap rather than as bytes.
+    report = subprocess.run(cli + ['--report', 'json', '--prefetch', '0'],
+                            capture_output=True, text=True)
+    found = json.loads(report.stdout)['summary']['diagrams_found']
+    if found != len(blocks):
+        raise RuntimeError(f"the CLI found {found} of {len(blocks)} diagrams")
+    timings['cli'] = best_time(
+        lambda: subprocess.run(cli, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL), repeat)
+    return timings
+
+
+def scaling_diagram(elements: int, seed: int) -> str:
+    """One generated flowchart with about the given number of elements."""
+    params = CorpusParams(files=1, diagrams=1, nodes=elements * 2 // 5,
+                          edges=elements * 3 // 5, depth=3, comments=0.1)
+    return '\n'.join(generate_diagram(random.Random(seed), params))
+
+
+def best_time_without_gc(func: Callable[[], object], repeat: int) -> float:
+    """best_time with the garbage collector paused, as timeit does.
+
+    Collections walk the whole heap, so with them a big enough diagram
+    looks superlinear whatever the code under test does.
+    """
+    import gc
+
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        return best_time(func, repeat)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def run_scaling(sizes: List[int], repeat: int, seed: int, max_growth: float) -> List[str]:
+    """Time parse, graph index and format at each size; returns the failures.
+
+    Linear-time stages take the same time per element at every size; a
+    stage whose time per element grows by more than max_growth between the
+    smallest and the largest diagram fails.
+    """
+    fm = load_formatter()
+    parser = fm.MermaidParser()
+    formatter = fm.MermaidFormatter()
+    path = Path('scaling.md')
+
+    stages = ('parse', 'index', 'format')
+    print(f"{'Elements':>10}" + ''.join(f"{stage + ' ms':>12}{'ns/elem':>10}" for stage in stages))
+    per_element = {stage: [] for stage in stages}
+    for size in sizes:
+        content = scaling_diagram(size, seed)
+        diagram = parser.parse(content, path)
+        index = fm.GraphIndex(diagram)
+        elements = len(diagram.elements)
+        times = {
+            'parse': best_time_without_gc(lambda: parser.parse(content, path), repeat),
+            'index': best_time_without_gc(lambda: fm.GraphIndex(diagram), repeat),
+            'format': best_time_without_gc(lambda: formatter.format(diagram, index), repeat),
+        }
+        for stage, seconds in times.items():
+            per_element[stage].append(seconds / elements)
+        print(f"{elements:>10,}"
+              + ''.join(f"{times[stage] * 1000:>12.2f}{per_element[stage][-1] * 1e9:>10.0f}"
+                        for stage in times))
+
+    return growth_failures(per_element, sizes, 'element', max_growth)
+
+
+def many_diagram_page(diagrams: int, seed: int) -> bytes:
+    """One generated page holding the given number of small diagrams."""
+    rng = random.Random(seed)
+    params = CorpusParams(files=1, diagrams=diagrams, nodes=10, edges=15, depth=1, comments=0.1)
+    parts = ["# Generated architecture page\n"]
+    for _ in range(diagrams):
+        for _ in range(FILLER_LINES):
+            parts.append(' '.join(rng.choices(LABEL_WORDS, k=8)) + '.\n')
+        parts.append('\n```mermaid\n' + '\n'.join(generate_diagram(rng, params)) + '\n```\n\n')
+    return ''.join(parts).encode('utf-8')
+
+
+def run_diagram_scaling(sizes: List[int], repeat: int, seed: int,
+                        max_growth: float) -> List[str]:
+    """Time process_file on pages of each number of diagrams; returns the failures.
+
+    Rebuilding a page costs time linear in its size, so the time per
+    diagram must stay flat as diagrams (and the page) are added.
+    """
+    fm = load_formatter()
+
+    def process_file():
+        return fm.MarkdownProcessor(memo_size=0).process_file(path)
+
+    print(f"{'Diagrams':>10}{'MB':>8}{'process_file ms':>18}{'us/diagram':>12}")
+    per_diagram = {'process_file': []}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'scaling.md'
+        for size in sizes:
+            data = many_diagram_page(size, seed)
+            path.write_bytes(data)
+            result = process_file()
+            if result.errors or result.diagrams_found != size:
+                return [f"{size:,} diagrams: found {result.diagrams_found:,}, "
+                        f"errors {result.errors[:1]}"]
+            seconds = best_time_without_gc(process_file, repeat)
+            per_diagram['process_file'].append(seconds / size)
+            print(f"{size:>10,}{len(data) / 1e6:>8.1f}{seconds * 1000:>18.1f}"
+                  f"{seconds / size * 1e6:>12.0f}")
+    return growth_failures(per_diagram, sizes, 'diagram', max_growth)
+
+
+def parse_tree_memory(formatter: str, content: str) -> Dict[str, int]:
+    """Bytes allocated by parsing content: held by the result, and at peak.
+
+    Runs in a fresh interpreter (see run_memory), so that nothing a
+    previous measurement left behind (interned IDs, grown dicts) is
+    counted for or against the next one.
+    """
+    import tracemalloc
+
+    fm = load_formatter(Path(formatter), 'format_mermaid_measured')
+    parser = fm.MermaidParser()
+    # Compile the patterns first, on a diagram sharing none of the IDs
+    parser.parse('flowchart TB\n    warmup["Warm up"] --> warmup2', Path('warmup.md'))
+    tracemalloc.start()
+    try:
+        diagram = parser.parse(content, Path('memory.md'))
+        held, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'held': held, 'peak': peak, 'elements': len(diagram.elements)}
+
+
+def run_memory(nodes: int, edges: int, seed: int, against: Optional[str],
+               threshold: float) -> List[str]:
+    """Measure the parse tree of one large flowchart; returns the failures."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    params = CorpusParams(files=1, diagrams=1, nodes=nodes, edges=edges, depth=3, comments=0.1)
+    content = '\n'.join(generate_diagram(random.Random(seed), params))
+    source = len(content.encode('utf-8'))
+    print(f"Flowchart: {nodes:,} nodes, {edges:,} edges, {source / 1e6:.2f} MB source")
+    print(f"{'Formatter':<20}{'held MB':>10}{'peak MB':>10}{'x source':>10}{'B/element':>11}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        formatters = []
+        if against:
+            reference = Path(tmp) / 'format_mermaid_reference.py'
+            reference.write_bytes(revision_source(against))
+            formatters.append((against, reference))
+        formatters.append(('working tree', MODULE))
+        for name, path in formatters:
+            with ProcessPoolExecutor(max_workers=1,
+                                     mp_context=multiprocessing.get_context('spawn')) as pool:
+                memory = pool.submit(parse_tree_memory, str(path), content).result()
+            results[name] = memory
+            print(f"{name:<20}{memory['held'] / 1e6:>10.1f}{memory['peak'] / 1e6:>10.1f}"
+                  f"{memory['held'] / source:>10.1f}{memory['held'] / memory['elements']:>11.0f}")
+
+    if not against:
+        return []
+    change = (results['working tree']['held'] / results[against]['held'] - 1) * 100
+    print(f"\nChange in memory held: {change:+.1f}%")
+    if change > threshold:
+        return [f"the parse tree needs {change:.1f}% more memory than at {against}"]
+    return []
+
+
+def growth_failures(costs: Dict[str, List[float]], sizes: List[int], unit: str,
+                    max_growth: float) -> List[str]:
+    """The stages whose cost per unit grew by more than max_growth across sizes."""
+    failures = []
+    for stage, stage_costs in costs.items():
+        growth = stage_costs[-1] / stage_costs[0]
+        if growth > max_growth:
+            failures.append(f"{stage}: time per {unit} grew {growth:.1f}x from "
+                            f"{sizes[0]:,} to {sizes[-1]:,} {unit}s")
+    return failures
+
+
+# =============================================================================
+# Editor Server
+# =============================================================================
+
+class ServerClient:
+    """Scripted editor client for format-mermaid.py --server.
+
+    Sends one JSON-RPC request per line and reads the response line, as an
+    editor integration does; error responses raise RuntimeError.
+    """
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, str(FORMATTER), '--server'], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, text=True, encoding='utf-8', bufsize=1)
+        self.next_id = 0
+
+    def request(self, method: str, params: Optional[dict] = None):
+        self.next_id += 1
+        message = {'jsonrpc': '2.0', 'id': self.next_id, 'method': method}
+        if params is not None:
+            message['params'] = params
+        self.process.stdin.write(json.dumps(message) + '\n')
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError(f"server exited during {method}")
+        response = json.loads(line)
+        if response.get('id') != self.next_id:
+            raise RuntimeError(f"{method}: response id {response.get('id')}, "
+                               f"expected {self.next_id}")
+        if 'error' in response:
+            raise RuntimeError(f"{method}: {response['error']['message']}")
+        return response['result']
+
+    def close(self) -> int:
+        """Shut the server down and return its exit code."""
+        self.request('shutdown')
+        self.process.stdin.close()
+        return self.process.wait(timeout=10)
+
+
+def apply_edits(text: str, edits: List[dict]) -> str:
+    """Apply whole-line LSP edits (as the server returns them) to text."""
+    lines = text.splitlines(keepends=True)
+    for edit in sorted(edits, key=lambda e: e['range']['start']['line'], reverse=True):
+        start, end = edit['range']['start']['line'], edit['range']['end']['line']
+        lines[start:end] = [edit['newText']]
+    return ''.join(lines)
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_server(corpus: Path, repeat: int) -> List[str]:
+    """Compare per-request latency of --server with spawning the script per buffer.
+
+    Every page of the corpus is sent to one server as formatDocument,
+    formatRange and validate requests, and formatted by spawning
+    format-mermaid.py on a copy of it. The server's edits must give the
+    same text as the spawned run. Returns the failures.
+    """
+    pages = {path: path.read_text(encoding='utf-8') for path in sorted(corpus.rglob('*.md'))}
+    failures = []
+
+    client = ServerClient()
+    server_ms = []
+    edited = {}
+    try:
+        for _ in range(repeat):
+            for path, text in pages.items():
+                params = {'text': text, 'uri': path.as_uri()}
+                start = time.perf_counter()
+                edits = client.request('formatDocument', params)['edits']
+                server_ms.append((time.perf_counter() - start) * 1000)
+                edited[path] = apply_edits(text, edits)
+
+                whole = {'start': {'line': 0, 'character': 0},
+                         'end': {'line': text.count('\n') + 1, 'character': 0}}
+                if client.request('formatRange', dict(params, range=whole))['edits'] != edits:
+                    failures.append(f"{path.name}: formatRange over the whole buffer "
+                                    "differs from formatDocument")
+                diagnostics = client.request('validate', params)['diagnostics']
+                if bool(diagnostics) != bool(edits):
+                    failures.append(f"{path.name}: {len(diagnostics)} diagnostics "
+                                    f"for {len(edits)} edits")
+    finally:
+        exit_code = client.close()
+    if exit_code != 0:
+        failures.append(f"server exited with {exit_code} after shutdown")
+
+    spawn_ms = []
+    with tempfile.TemporaryDirectory() as tmp:
+        buffer = Path(tmp) / 'buffer.md'
+        cli = [sys.executable, str(FORMATTER), '--no-cache', str(buffer)]
+        for path, text in pages.items():
+            buffer.write_text(text, encoding='utf-8')
+            start = time.perf_counter()
+            subprocess.run(cli, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            spawn_ms.append((time.perf_counter() - start) * 1000)
+            if buffer.read_text(encoding='utf-8') != edited[path]:
+                failures.append(f"{path.name}: server edits differ from the spawned run")
+
+    server_median = percentile(server_ms, 0.5)
+    spawn_median = percentile(spawn_ms, 0.5)
+    print(f"{'formatDocument':<16}{'requests':>10}{'median ms':>12}{'p95 ms':>10}")
+    print(f"{'server':<16}{len(server_ms):>10}{server_median:>12.2f}"
+          f"{percentile(server_ms, 0.95):>10.2f}")
+    print(f"{'spawn':<16}{len(spawn_ms):>10}{spawn_median:>12.2f}"
+          f"{percentile(spawn_ms, 0.95):>10.2f}")
+    print(f"\nServer is {spawn_median / server_median:.0f}x faster per request")
+    return failures
+
+
+# =============================================================================
+# Reporting and Baselines
+# =============================================================================
+
+def throughput(timings: Dict[str, float], stats: Dict[str, int]) -> Dict[str, Dict[str, float]]:
+    return {
+        stage: {
+            'lines_per_s': stats['diagram_lines'] / seconds,
+            'diagrams_per_s': stats['diagrams'] / seconds,
+            'files_per_s': stats['files'] / seconds,
+            'seconds': seconds,
+        }
+        for stage, seconds in timings.items()
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Return the stages whose throughput dropped more than threshold percent."""
+    regressions = []
+    for stage, current in results.items():
+        previous = baseline.get(stage)
+        if not previous:
+            continue
+        change = (current['lines_per_s'] / previous['lines_per_s'] - 1) * 100
+        current['change_pct'] = change
+        if change < -threshold:
+            regressions.append(stage)
+    return regressions
+
+
+def print_report(profile: str, params: CorpusParams, stats: Dict[str, int], results: dict,
+                 regressions: List[str]):
+    print(f"\n{'=' * 72}")
+    print(f"Benchmark: {profile} ({stats['files']} files, {stats['diagrams']} diagrams, "
+          f"{stats['diagram_lines']:,} diagram lines, {stats['bytes'] / 1e6:.1f} MB)")
+    print(f"Corpus: {asdict(params)}")
+    print(f"{'=' * 72}")
+    print(f"{'Stage':<14}{'lines/s':>14}{'diagrams/s':>14}{'files/s':>12}{'seconds':>10}"
+          f"{'vs baseline':>16}")
+    for stage, r in results.items():
+        change = f"{r['change_pct']:+.1f}%" if 'change_pct' in r else '-'
+        if stage in regressions:
+            change += ' REGRESSION'
+        print(f"{stage:<14}{r['lines_per_s']:>14,.0f}{r['diagrams_per_s']:>14,.1f}"
+              f"{r['files_per_s']:>12,.0f}{r['seconds']:>10.3f}{change:>16}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark format-mermaid.py on a synthetic corpus'
+    )
+    parser.add_argument('--profile', choices=sorted(PROFILES), default='small',
+                        help='Corpus profile (default: small)')
+    for name, kind, help_text in [
+        ('files', int, 'Number of Markdown files'),
+        ('diagrams', int, 'Diagrams per file'),
+        ('nodes', int, 'Node definitions per diagram'),
+        ('edges', int, 'Connections per diagram'),
+        ('depth', int, 'Maximum subgraph nesting depth'),
+        ('comments', float, 'Comment density (0-1)'),
+        ('plain', float, 'Fraction of files without diagrams (0-1)'),
+        ('huge', int, 'Files padded past 1.2 MB'),
+    ]:
+        parser.add_argument(f'--{name}', type=kind, help=f'{help_text} (overrides profile)')
+    parser.add_argument('--seed', type=int, default=1, help='Corpus random seed (default: 1)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Timed repetitions; the fastest is reported (default: 3)')
+    parser.add_argument('--corpus-dir', help='Write the corpus here and keep it')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help=f'Baseline file (default: {DEFAULT_BASELINE})')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store this run as the baseline for the profile')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Regression threshold in percent (default: {DEFAULT_THRESHOLD:g})')
+    parser.add_argument('--scaling', nargs='?', const='elements', choices=sorted(DEFAULT_SIZES),
+                        help='Time parse, graph index and format on single diagrams of --sizes '
+                             'elements, or process_file on pages of --sizes diagrams')
+    parser.add_argument('--sizes',
+                        help='Sizes for --scaling (default: '
+                             f"{DEFAULT_SIZES['elements']} or {DEFAULT_SIZES['diagrams']})")
+    parser.add_argument('--max-growth', type=float, default=DEFAULT_MAX_GROWTH,
+                        help='Allowed growth in time per element or diagram across --sizes '
+                             f'(default: {DEFAULT_MAX_GROWTH:g})')
+    parser.add_argument('--memory', action='store_true',
+                        help='Measure the memory held by the parse tree of one large flowchart')
+    parser.add_argument('--against', metavar='REV',
+                        help='With --memory, also measure the formatter at this git revision')
+    parser.add_argument('--server', action='store_true',
+                        help='Time --server requests against spawning the script per page')
+    args = parser.parse_args()
+
+    if args.memory:
+        try:
+            failures = run_memory(args.nodes or MEMORY_NODES, args.edges or MEMORY_EDGES,
+                                  args.seed, args.against, args.threshold)
+        except subprocess.CalledProcessError as e:
+            parser.error(f"cannot read {FORMATTER.name} at {args.against}: "
+                         f"{e.stderr.decode(errors='replace').strip()}")
+        for failure in failures:
+            print(f"\nMemory check failed: {failure}")
+        return 1 if failures else 0
+
+    if args.scaling:
+        sizes_arg = args.sizes or DEFAULT_SIZES[args.scaling]
+        try:
+            sizes = sorted(int(size) for size in sizes_arg.split(','))
+        except ValueError:
+            parser.error(f"--sizes expects comma-separated integers, got {sizes_arg!r}")
+        run = run_scaling if args.scaling == 'elements' else run_diagram_scaling
+        failures = run(sizes, args.repeat, args.seed, args.max_growth)
+        for failure in failures:
+            print(f"\nScaling check failed: {failure}")
+        if not failures:
+            print("\nScaling check passed.")
+        return 1 if failures else 0
+
+    params = CorpusParams(**asdict(PROFILES[args.profile]))
+    for name in asdict(params):
+        if getattr(args, name) is not None:
+            setattr(params, name, getattr(args, name))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = Path(args.corpus_dir) if args.corpus_dir else Path(tmp)
+        stats = generate_corpus(corpus, params, args.seed)
+        if args.server:
+            failures = run_server(corpus, args.repeat)
+            for failure in failures[:10]:
+                print(f"\nServer check failed: {failure}")
+            return 1 if failures else 0
+        try:
+            results = throughput(run_benchmarks(corpus, args.repeat), stats)
+        except RuntimeError as e:
+            print(f"Benchmark failed: {e}")
+            return 1
+
+    # Baselines are stored per profile and corpus shape so they stay comparable
+    baseline_path = Path(args.baseline)
+    key = f"{args.profile}:{json.dumps(asdict(params), sort_keys=True)}:{args.seed}"
+    try:
+        baselines = json.loads(baseline_path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        baselines = {}
+
+    regressions = compare(results, baselines.get(key, {}), args.threshold)
+    print_report(args.profile, params, stats, results, regressions)
+
+    if args.save_baseline:
+        baselines[key] = {stage: {k: v for k, v in r.items() if k != 'change_pct'}
+                          for stage, r in results.items()}
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(baselines, indent=2), encoding='utf-8')
+        print(f"\nBaseline saved to {baseline_path}")
+
+    if regressions:
+        print(f"\nThroughput regressed by more than {args.threshold:g}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
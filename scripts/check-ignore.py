@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Ignore Rules Check for format-mermaid.py
+
+Checks that the directory walk skips exactly the Markdown files git
+ignores. Each trial writes a small tree of pages into a new git
+repository, with random .gitignore patterns at the top and in a
+subdirectory, and compares the files find_markdown_files returns with
+`git check-ignore`. Negated (!) patterns are not supported by the walk
+and are not generated.
+
+Usage:
+    python check-ignore.py [options]
+
+Options:
+    --trials N      Random .gitignore setups to check (default: 300)
+    --seed N        Random seed (default: 1)
+"""
+
+import argparse
+import importlib.util
+import random
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import List, Set
+
+
+FORMATTER = Path(__file__).resolve().parent / 'format_mermaid.py'
+
+DIRECTORIES = ['', 'docs', 'docs/sub', 'docs/sub/deep', 'docs/gen', 'a', 'a/b', 'a/b/c',
+               'drafts', 'x', 'gen', 'nested/y/x']
+PAGES = ['a.md', 'b.md', 'top.md', 'z.tmp.md', 'foobar.md', 'foo-bar.md']
+
+PATTERNS = ['docs/*.md', 'drafts/', '/top.md', 'top.md', 'b.md', '*.tmp.md', 'a/**/c',
+            'a/**/a.md', '**/gen/', '**/gen', 'docs/**', 'sub/*', '/sub/*', '?.md', '[ab].md',
+            'x/[!a]*.md', 'docs/sub/', '**/deep/*.md', 'a/**', 'foo*bar.md', 'nested/**/x/',
+            'a/b', '/a/b/', 'b', 'deep', '*/b.md', 'docs/*/', 'f?o*.md', 'foo\\-bar.md', '*']
+
+# Patterns for the .gitignore in docs/, relative to it
+NESTED_PATTERNS = ['*.md', 'sub/', '/a.md', 'sub/*.md', '**/b.md', 'gen', 'deep/top.md']
+
+
+def load_formatter():
+    """Import the formatter module, format_mermaid.py."""
+    spec = importlib.util.spec_from_file_location('format_mermaid', FORMATTER)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def git_ignored(top: Path, pages: List[str]) -> Set[str]:
+    """The pages git ignores, per `git check-ignore`."""
+    result = subprocess.run(['git', 'check-ignore', '--stdin'], cwd=top, capture_output=True,
+                            text=True, input='\n'.join(pages) + '\n')
+    if result.returncode > 1:
+        raise RuntimeError(f"git check-ignore failed: {result.stderr.strip()}")
+    return set(result.stdout.splitlines())
+
+
+def check_trial(fm, top: Path, rng: random.Random) -> List[str]:
+    """Write one random setup to top and compare; returns the mismatches."""
+    pages = [f"{directory}/{page}".lstrip('/') for directory in DIRECTORIES for page in PAGES]
+    for page in pages:
+        path = top / page
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('# Page\n', encoding='utf-8')
+    root = rng.sample(PATTERNS, rng.randint(1, 3))
+    nested = rng.sample(NESTED_PATTERNS, rng.randint(0, 2))
+    (top / '.gitignore').write_text('\n'.join(root) + '\n', encoding='utf-8')
+    (top / 'docs' / '.gitignore').write_text('\n'.join(nested) + '\n', encoding='utf-8')
+
+    walked = {path.relative_to(top).as_posix() for path in fm.find_markdown_files([str(top)])}
+    expected = set(pages) - git_ignored(top, pages)
+    if walked == expected:
+        return []
+    setup = f".gitignore {root!r}, docs/.gitignore {nested!r}"
+    return ([f"{setup}: walk skips {page}, git does not" for page in sorted(expected - walked)]
+            + [f"{setup}: walk keeps {page}, git ignores it" for page in sorted(walked - expected)])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check that the format-mermaid.py walk ignores what git ignores'
+    )
+    parser.add_argument('--trials', type=int, default=300,
+                        help='Random .gitignore setups to check (default: 300)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    args = parser.parse_args()
+
+    fm = load_formatter()
+    rng = random.Random(args.seed)
+    failures = []
+    for _ in range(args.trials):
+        with tempfile.TemporaryDirectory() as tmp:
+            top = Path(tmp)
+            subprocess.run(['git', 'init', '-q', str(top)], check=True)
+            failures += check_trial(fm, top, rng)
+
+    print(f"{args.trials} random .gitignore setups (seed {args.seed}), "
+          f"{len(failures)} mismatches")
+    if failures:
+        for failure in failures[:10]:
+            print(f"\nIgnore check failed: {failure}")
+        if len(failures) > 10:
+            print(f"\n... and {len(failures) - 10} more")
+        return 1
+
+    print("\nIgnore check passed.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
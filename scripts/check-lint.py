@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Lint Check for format-mermaid.py
+
+Runs --lint's graph checks on fixed diagrams and compares the findings
+with the expected ones. The cases cover edge statements the parser
+leaves unparsed (endpoints with inline labels, chains A --> B --> C and
+fan-outs A & B --> C), which must not turn into warnings about nodes
+without edges, and diagrams where the checks must still fire. Two cases
+are taken from _portfolio/ocne2_information_architecture.md.
+
+Usage:
+    python check-lint.py
+"""
+
+import argparse
+import importlib.util
+import sys
+from pathlib import Path
+from typing import List
+
+
+FORMATTER = Path(__file__).resolve().parent / 'format_mermaid.py'
+
+# (name, diagram, expected findings as "line N: message"); line numbers
+# count from the flowchart declaration as line 1
+CASES = [
+    ('Journey 5 of the OCNE 2 information architecture: endpoints with inline labels', '''\
+flowchart TB
+  subgraph DayTwo["Day-2 Operations Hub"]
+    KC10["Kubernetes Clusters<br/>Ch 10: Administration"]
+  end
+  CLI["CLI Reference<br/>Command syntax"] <--> KC10
+  RN["Release Notes<br/>Patches & issues"] <--> KC10
+  K8S["Kubernetes<br/>App troubleshooting"] <--> KC10
+  APP["Applications<br/>App updates"] <--> KC10
+  class KC10 chapter;''', []),
+
+    ('Chapter layout of the OCNE 2 information architecture: no edges at all', '''\
+flowchart TB
+  subgraph Reference["Reference & Updates"]
+    RN["Release Notes"]
+    CLI["CLI Reference"]
+  end
+  subgraph Core["Core Operations"]
+    KC["Kubernetes Clusters"]
+    APP["Applications"]
+  end
+  class RN,CLI,KC,APP chapter;''', []),
+
+    ('Chain', '''\
+flowchart LR
+  A["Install"]
+  B["Configure"]
+  C["Verify"]
+  D["Unused"]
+  A --> B --> C''', ['line 5: node D has no edges']),
+
+    ('Fan-out', '''\
+flowchart LR
+  A["Release Notes"]
+  B["CLI Reference"]
+  C["Clusters"]
+  A & B -.-> C''', []),
+
+    ('Edge text the lint cannot read', '''\
+flowchart LR
+  A["Start"]
+  B["Unused"]
+  A -- next --> C''', []),
+
+    ('Parsed edges', '''\
+flowchart LR
+  A["Start"]
+  B["Unused"]
+  subgraph One
+    C["Step"]
+  end
+  subgraph Two
+    C["Step again"]
+  end
+  A --> C
+  A --> Z''', ['line 3: node B has no edges',
+               'line 8: node C is declared in subgraphs One and Two',
+               'line 11: edge A --> Z uses undefined node Z']),
+]
+
+
+def load_formatter():
+    """Import the formatter module, format_mermaid.py."""
+    spec = importlib.util.spec_from_file_location('format_mermaid', FORMATTER)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def lint(fm, content: str) -> List[str]:
+    """The lint findings for one diagram, in the form --lint reports them."""
+    diagram = fm.MermaidParser().parse(content, Path('check-lint.md'))
+    return [f"line {line + 1}: {message}" for line, message in fm.GraphIndex(diagram).lint()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check the format-mermaid.py lint findings on fixed diagrams'
+    )
+    parser.parse_args()
+
+    fm = load_formatter()
+    failures = []
+    for name, content, expected in CASES:
+        found = lint(fm, content)
+        if found != expected:
+            failures.append(f"{name}:\n    expected: {expected!r}\n    found:    {found!r}")
+
+    print(f"{len(CASES)} diagrams linted, {len(failures)} mismatches")
+    if failures:
+        for failure in failures:
+            print(f"\nLint check failed: {failure}")
+        return 1
+
+    print("\nLint check passed.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Startup Budget Check for format-mermaid.py
+
+Runs the formatter the way a pre-commit hook does (one Markdown file, no
+diagrams) under `python -X importtime` and checks that:
+
+  - none of the modules the formatter defers until needed are imported
+  - startup overhead over a bare interpreter stays within the budget
+
+The budget is the overhead of the formatter before the performance work,
+plus a margin for timing noise. With --against, that overhead is measured
+on this machine from a git revision instead. Bytecode is written as usual
+(PYTHONDONTWRITEBYTECODE is dropped), since a cached format_mermaid.py is
+what a real run starts from.
+
+Usage:
+    python check-startup.py [options]
+
+Options:
+    --budget-ms MS  Allowed startup overhead in milliseconds (default: 70)
+    --against REV   Use the overhead of the formatter at a git revision,
+                    plus 20%, as the budget
+    --runs N        Timed runs; the fastest is used (default: 20)
+    --top N         Show the N slowest imports (profile startup)
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+
+SCRIPTS = Path(__file__).resolve().parent
+FORMATTER = SCRIPTS / 'format-mermaid.py'
+MODULE = SCRIPTS / 'format_mermaid.py'
+
+# Startup overhead of format-mermaid.py at the baseline commit, before the
+# performance work, measured with this script: 58 ms on a typical Linux
+# machine. The budget allows 20% over it for timing noise.
+BASELINE_MS = 58
+MARGIN = 0.20
+DEFAULT_BUDGET_MS = round(BASELINE_MS * (1 + MARGIN))
+
+# Imported lazily by the formatter; loading any of these at startup is a
+# regression
+DEFERRED_MODULES = [
+    'concurrent.futures',
+    'ctypes',
+    'difflib',
+    'hashlib',
+    'json',
+    'multiprocessing',
+    'subprocess',
+    'tempfile',
+]
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int]]:
+    """Parse -X importtime output into (module, self_us, cumulative_us) tuples."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # One leading space marks a top-level import; nested ones are indented
+        imports.append((name[1:].rstrip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def min_runtimes(cmds: List[List[str]], runs: int, cwd: Path, env: dict) -> List[float]:
+    """Fastest wall time of each command over runs, in seconds.
+
+    The commands take turns, so a slow stretch on a busy machine slows
+    all of them rather than one.
+    """
+    best = [float('inf')] * len(cmds)
+    for _ in range(runs):
+        for i, cmd in enumerate(cmds):
+            start = time.perf_counter()
+            subprocess.run(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+            best[i] = min(best[i], time.perf_counter() - start)
+    return best
+
+
+def checkout_revision(revision: str, directory: Path) -> Path:
+    """Write the formatter as of a git revision to directory; returns its script.
+
+    Revisions from before format_mermaid.py was split out only have
+    format-mermaid.py.
+    """
+    for path in (MODULE, FORMATTER):
+        proc = subprocess.run(['git', 'show', f'{revision}:./{path.name}'], cwd=SCRIPTS,
+                              capture_output=True)
+        if proc.returncode != 0:
+            if path == FORMATTER:
+                raise RuntimeError(proc.stderr.decode(errors='replace').strip())
+            continue
+        (directory / path.name).write_bytes(proc.stdout)
+    return directory / FORMATTER.name
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Check format-mermaid.py startup cost against a budget'
+    )
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help=f'Allowed startup overhead in ms (default: {DEFAULT_BUDGET_MS})')
+    parser.add_argument('--against', metavar='REV',
+                        help='Use the overhead of the formatter at a git revision, '
+                             'plus 20%%, as the budget')
+    parser.add_argument('--runs', type=int, default=20,
+                        help='Timed runs; the fastest is used (default: 20)')
+    parser.add_argument('--top', type=int, default=0, metavar='N',
+                        help='Show the N slowest imports')
+    args = parser.parse_args()
+
+    env = {name: value for name, value in os.environ.items()
+           if name != 'PYTHONDONTWRITEBYTECODE'}
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        (workdir / 'page.md').write_text('# Page\n\nNo diagrams here.\n', encoding='utf-8')
+        formatter_cmd = [sys.executable, str(FORMATTER), '--validate', '--no-cache', 'page.md']
+
+        cmds = [[sys.executable, '-c', 'pass'], formatter_cmd]
+        if args.against:
+            reference = workdir / 'reference'
+            reference.mkdir()
+            try:
+                script = checkout_revision(args.against, reference)
+            except RuntimeError as e:
+                print(f"Error: cannot read {FORMATTER.name} at {args.against}: {e}",
+                      file=sys.stderr)
+                return 2
+            # Cache options differ between revisions; page.md has no diagrams
+            # to cache, so the reference runs with its defaults
+            cmds.append([sys.executable, str(script), '--validate', 'page.md'])
+
+        # Warm up first, so format_mermaid.py's bytecode is cached for every
+        # run below, the one under -X importtime included
+        for cmd in cmds:
+            subprocess.run(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL)
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', *formatter_cmd[1:]],
+            cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True
+        )
+        if proc.returncode != 0:
+            print(proc.stderr)
+            print("Startup check failed: formatter exited with an error.")
+            return 1
+
+        bare, *times = min_runtimes(cmds, args.runs, workdir, env)
+        overhead = times[0] - bare
+        if args.against:
+            reference_overhead = times[1] - bare
+            args.budget_ms = reference_overhead * 1000 * (1 + MARGIN)
+
+    imports = parse_importtime(proc.stderr)
+    imported = {name.strip() for name, _, _ in imports}
+    top_level_us = sum(cumulative for name, _, cumulative in imports if not name.startswith(' '))
+
+    print(f"Import time (under -X importtime): {top_level_us / 1000:.1f} ms")
+    if args.against:
+        print(f"{f'Startup overhead at {args.against}:':<35}{reference_overhead * 1000:.1f} ms")
+    print(f"Startup overhead:                  {overhead * 1000:.1f} ms "
+          f"(budget {args.budget_ms:.0f} ms)")
+
+    if args.top:
+        print("\nSlowest imports (self time):")
+        for name, self_us, cumulative_us in sorted(imports, key=lambda i: -i[1])[:args.top]:
+            print(f"  {self_us / 1000:7.2f} ms  (cumulative {cumulative_us / 1000:7.2f} ms)  "
+                  f"{name.strip()}")
+
+    failures = []
+    eager = sorted(m for m in DEFERRED_MODULES if m in imported)
+    if eager:
+        failures.append(f"deferred modules imported at startup: {', '.join(eager)}")
+    if overhead * 1000 > args.budget_ms:
+        failures.append(f"startup overhead {overhead * 1000:.1f} ms exceeds "
+                        f"{args.budget_ms:.0f} ms budget")
+
+    if failures:
+        for failure in failures:
+            print(f"\nStartup check failed: {failure}")
+        return 1
+
+    print("\nStartup check passed.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
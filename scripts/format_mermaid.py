@@ -0,0 +1,4002 @@
+"""
+Mermaid Diagram Formatter
+
+Formats Mermaid diagrams in Markdown files according to the style guide.
+See docs/mermaid-style-guide.md for formatting rules. The rules cover
+flowchart (graph) diagrams; sequenceDiagram, stateDiagram and classDiagram
+blocks are only re-indented, and diagrams of other types are left as they are.
+
+Usage:
+    python format-mermaid.py [options] [paths...]
+
+Options:
+    --dry-run       Preview changes without modifying files
+    --validate      Check conformance and exit with code 1 if issues found
+    --diff          Show unified diff of changes
+    --fail-fast     With --validate, stop at the first non-conforming file
+    --lint          Also report edges to undefined nodes, nodes without edges
+                    and nodes declared in more than one subgraph
+    --jobs N        Process files with N worker processes ('auto' = CPU count)
+    --prefetch N    With one job, read up to N files ahead of the parser (0 disables)
+    --cache-dir DIR Directory for the result cache (default: .cache/format-mermaid)
+    --no-cache      Do not read or write the result cache
+    --memo-size N   Reuse formatting for up to N distinct diagrams (0 disables)
+    --stream-threshold MB
+                    Stream files of at least MB megabytes instead of loading them
+    --fsync         fsync rewritten files (grouped at the end of the run)
+    --watch         Keep running and reformat (or validate) files when they are saved
+    --poll          In watch mode, poll for changes even if inotify is available
+    --server        Serve JSON-RPC format/validate requests on stdin/stdout
+    --exclude PATTERN
+                    Skip matching files and directories when walking
+                    directories (repeatable; .gitignore and the exclude:
+                    list in _config.yml are honored too)
+    --changed-since REF
+                    Only process Markdown files changed since REF (git)
+    --staged        Only process Markdown files staged in the git index
+    --report FORMAT Stream a json or ndjson report to stdout (other output to stderr)
+    --profile       Report time per phase and the slowest files and diagrams
+    --profile-out FILE
+                    Write a cProfile (pstats) dump of the run to FILE
+    --verbose, -v   Verbose output
+"""
+
+# The command line entry point is format-mermaid.py; the implementation is
+# this module so that Python caches its bytecode instead of compiling it on
+# every run. Modules only needed by some options (argparse, difflib, json,
+# hashlib, subprocess, tempfile, concurrent.futures) are imported where
+# they are used to keep startup fast; see scripts/check-startup.py.
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from itertools import chain, islice
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# =============================================================================
+# Configuration - Based on mermaid_template_latest.mmd
+# =============================================================================
+
+# Template uses NO init block - diagrams start directly with flowchart
+# Set to None to omit init block entirely
+CANONICAL_INIT_BLOCK = None
+
+INDENT = "  "  # 2 spaces (matching template)
+
+# Color palette from template
+# #235789 (blue) - brand blue, used for main arrows and node text
+# #F1D302 (yellow) - used for content node borders, workflow arrows
+# #C1292E (red) - used for workflow node borders, cross-ref arrows
+
+# Standard style classes from template (two types)
+STANDARD_CLASSDEFS = {
+    # Main content nodes: white fill, yellow border, blue text
+    'chapter': 'fill:#fff,stroke:#F1D302,stroke-width:2px,color:#235789,font-size:16px,font-weight:bold',
+    # Workflow/process nodes: white fill, red border, blue text
+    'workflowNode': 'fill:#fff,stroke:#C1292E,stroke-width:2px,color:#235789,font-size:16px,font-weight:bold',
+}
+
+# Link styles from template (indexed by connection type)
+# Main arrows: thick brand blue
+LINKSTYLE_MAIN = 'stroke:#235789,stroke-width:3px'
+# Workflow/section jumps: yellow, thick, dashed
+LINKSTYLE_WORKFLOW = 'stroke:#F1D302,stroke-width:2.5px,stroke-dasharray:6,5'
+# Cross-references: red, thick, dotted
+LINKSTYLE_CROSSREF = 'stroke:#C1292E,stroke-width:2.5px,stroke-dasharray:2,5'
+
+# Enforce standard colors - replace custom classDef names with standard ones
+ENFORCE_STANDARD_COLORS = True
+
+# Bump when formatting rules change; invalidates cached results
+FORMATTER_VERSION = '1.2'
+
+DEFAULT_CACHE_DIR = '.cache/format-mermaid'
+
+# Files at least this large (in MB) are streamed rather than loaded whole
+DEFAULT_STREAM_THRESHOLD_MB = 16
+
+# Number of distinct formatted diagrams remembered across files
+DEFAULT_MEMO_SIZE = 256
+
+# Files read ahead of the parser (--prefetch), and the threads reading them
+DEFAULT_PREFETCH = 8
+PREFETCH_THREADS = 4
+
+# With --jobs, batches of files in flight per worker process, and the
+# source size at which a batch is closed early
+POOL_BATCHES_AHEAD = 2
+POOL_BATCH_BYTES = 1024 * 1024
+
+# Directories a walk never enters: git metadata, installed dependencies and
+# Jekyll's build output. .gitignore, _config.yml exclude: and --exclude add more.
+PRUNED_DIRS = frozenset({'.git', '.jekyll-cache', '_site', 'node_modules', 'vendor'})
+
+MARKDOWN_SUFFIXES = ('.md', '.markdown')
+
+# Watch mode: polling interval and how long a file must be stable (seconds)
+DEFAULT_WATCH_INTERVAL = 0.1
+WATCH_DEBOUNCE = 0.05
+
+
+# =============================================================================
+# Data Structures
+# =============================================================================
+
+# Diagram elements use __slots__ (Python 3.10+) so that huge generated
+# diagrams do not pay for a per-instance __dict__
+_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_SLOTS)
+class DiagramElement:
+    """Base class for diagram elements."""
+    element_type: str
+    raw_text: str
+    line_number: int
+    indent_level: int = 0
+
+
+@dataclass(**_SLOTS)
+class Comment(DiagramElement):
+    """A comment line: %% text"""
+    text: str = ""
+
+
+@dataclass(**_SLOTS)
+class NodeDefinition(DiagramElement):
+    """Node definition: ID["Label"] or ID([Label]) etc."""
+    node_id: str = ""
+    label: Optional[str] = None
+    shape_start: str = "["
+    shape_end: str = "]"
+
+
+@dataclass(**_SLOTS)
+class Connection(DiagramElement):
+    """Connection between nodes: A --> B"""
+    source: str = ""
+    target: str = ""
+    arrow: str = "-->"
+    label: Optional[str] = None
+
+
+@dataclass(**_SLOTS)
+class SubgraphStart(DiagramElement):
+    """subgraph ID["Label"]"""
+    subgraph_id: str = ""
+    label: Optional[str] = None
+
+
+@dataclass(**_SLOTS)
+class SubgraphEnd(DiagramElement):
+    """end keyword"""
+    pass
+
+
+@dataclass(**_SLOTS)
+class ClassDef(DiagramElement):
+    """classDef name properties;"""
+    class_name: str = ""
+    properties: str = ""
+
+
+@dataclass(**_SLOTS)
+class ClassApplication(DiagramElement):
+    """class node1,node2 className;"""
+    node_ids: List[str] = field(default_factory=list)
+    class_name: str = ""
+
+
+@dataclass(**_SLOTS)
+class LinkStyle(DiagramElement):
+    """linkStyle indices properties"""
+    indices: List[int] = field(default_factory=list)
+    properties: str = ""
+
+
+@dataclass(**_SLOTS)
+class DiagramDeclaration(DiagramElement):
+    """flowchart TB or graph LR"""
+    diagram_type: str = "flowchart"
+    direction: str = "TB"
+
+
+@dataclass(**_SLOTS)
+class OtherLine(DiagramElement):
+    """Any line we don't specifically parse but preserve."""
+    pass
+
+
+@dataclass(**_SLOTS)
+class InitBlock:
+    """The %%{init: ...}%% configuration block."""
+    theme: str = "default"
+    theme_variables: Dict[str, str] = field(default_factory=dict)
+    raw_text: str = ""
+
+
+@dataclass(**_SLOTS)
+class MermaidDiagram:
+    """A complete parsed Mermaid diagram."""
+    source_file: Path
+    start_line: int
+    end_line: int
+    raw_content: str
+    init_block: Optional[InitBlock] = None
+    declaration: Optional[DiagramDeclaration] = None
+    elements: List[DiagramElement] = field(default_factory=list)
+
+
+@dataclass
+class FormatResult:
+    """Result of formatting a single diagram."""
+    original: str
+    formatted: str
+    changed: bool
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+
+
+@dataclass
+class FileResult:
+    """Result of processing a single file."""
+    file_path: Path
+    diagrams_found: int
+    diagrams_changed: int
+    original_content: str
+    formatted_content: str
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+    cached: bool = False      # Result came from the result cache
+    streamed: bool = False    # Processed by stream_file; no content kept
+    written: bool = False     # File was already rewritten in place
+    memo_hits: int = 0        # Diagrams reused from the in-memory memo
+    memo_misses: int = 0
+    # (first line, last line, changed) of each diagram's fenced block, 1-based
+    spans: List[Tuple[int, int, bool]] = field(default_factory=list)
+    # (start, end, new start, new end, first line) of each rewritten diagram
+    # body: offsets into original_content and formatted_content, and the
+    # 0-based line of its first body line. Lets --diff skip unchanged text.
+    edits: List[Tuple[int, int, int, int, int]] = field(default_factory=list)
+    elapsed: float = 0.0      # Wall time spent processing the file (seconds)
+    # Filled only with --profile: phase -> [wall, cpu] seconds, and
+    # (start line, wall seconds) for each diagram formatted
+    timings: Dict[str, List[float]] = field(default_factory=dict)
+    diagram_times: List[Tuple[int, float]] = field(default_factory=list)
+
+    def release_content(self):
+        """Drop the file content once the file has been diffed and written.
+
+        Counts, errors, warnings and spans are all the summary and reports
+        need, so a run holds the content of one file at a time, even where
+        a generator still references the previous result.
+        """
+        self.original_content = ""
+        self.formatted_content = ""
+        self.edits = []
+
+
+# =============================================================================
+# Parser
+# =============================================================================
+
+class _Lazy:
+    """Class attribute computed on first access, then stored on the class.
+
+    Used to defer regex compilation until a pattern is first needed; after
+    that the attribute is a plain class attribute with no lookup overhead.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        value = self.factory()
+        setattr(owner if owner is not None else type(obj), self.name, value)
+        return value
+
+
+def _lazy_compile(pattern: str, flags: int = 0) -> _Lazy:
+    """A regex class attribute that is compiled on first use."""
+    return _Lazy(lambda: re.compile(pattern, flags))
+
+
+def _lazy_compile_all(*patterns: str) -> _Lazy:
+    """A list of regex class attributes compiled together on first use."""
+    return _Lazy(lambda: [re.compile(pattern) for pattern in patterns])
+
+
+class MermaidParser:
+    """Parses Mermaid diagram content into structured representation."""
+
+    # Regex patterns (compiled on first use)
+    #
+    # Every line pattern runs in linear time. Wherever two neighbouring
+    # parts could match the same whitespace (a "\s*" next to a label that
+    # may itself contain spaces), the split is pinned to the one the
+    # backtracking search would settle on first: a lookahead fixes it, or
+    # the "\s*" goes where the label already absorbs those spaces. Captures
+    # are unchanged, but a malformed line can no longer make the engine
+    # retry every split of a long whitespace run.
+    INIT_BLOCK_PATTERN = _lazy_compile(
+        r'%%\{init:\s*(\{.*?\})\s*\}%%',
+        re.DOTALL
+    )
+    # Where an init block may start, and whether one can end after that
+    INIT_START_PATTERN = _lazy_compile(r'%%\{init:\s*(?=\{)')
+    INIT_END_PATTERN = _lazy_compile(r'\}\s*\}%%')
+
+    DIAGRAM_DECL_PATTERN = _lazy_compile(
+        r'^(flowchart|graph)(?:\s*(TB|BT|LR|RL|TD))?\s*$',
+        re.IGNORECASE
+    )
+
+    COMMENT_PATTERN = _lazy_compile(r'^(\s*)%%\s*(.*)$')
+
+    SUBGRAPH_START_PATTERN = _lazy_compile(
+        r'^(\s*)subgraph\s+(\w+)(?:\s*\["([^"]+)"\]|\s*\[([^\]]+)\])?\s*$',
+        re.IGNORECASE
+    )
+
+    SUBGRAPH_END_PATTERN = _lazy_compile(r'^(\s*)end\s*$', re.IGNORECASE)
+
+    # Node patterns - various shapes
+    NODE_PATTERNS = _lazy_compile_all(
+        # Stadium shape: ID([Label]) or ID(["Label"])
+        r'^(\s*)(\w+)\s*\(\[\s*(?!\s)"?([^"\]]*)(?:"\s*)?\]\)\s*$',
+        # Trapezoid forward: ID[/"Label"/] - must match before generic rectangle
+        r'^(\s*)(\w+)\s*\[/\s*(?!\s)"?([^"]*)(?:"\s*)?/\]\s*$',
+        # Trapezoid reverse: ID[\"Label"\] - must match before generic rectangle
+        r'^(\s*)(\w+)\s*\[\\\s*(?!\s)"?([^"]*)(?:"\s*)?\\\]\s*$',
+        # Rectangle with quotes: ID["Label"]
+        r'^(\s*)(\w+)\s*\[\s*"([^"]*)"\s*\]\s*$',
+        # Rectangle without quotes: ID[Label] (an all-blank label keeps
+        # its last space)
+        r'^(\s*)(\w+)\s*\[\s*(?=[^\s\]]|\s\])([^\]]+)\]\s*$',
+        # Bare node: ID
+        r'^(\s*)(\w+)\s*$',
+    )
+
+    # Shape markers for each of NODE_PATTERNS
+    NODE_SHAPES = (
+        ('([', '])'),
+        ('[/', '/]'),
+        ('[\\', '\\]'),
+        ('[', ']'),
+        ('[', ']'),
+        ('[', ']'),
+    )
+
+    # Connection patterns
+    CONNECTION_PATTERNS = _lazy_compile_all(
+        # With label: A -->|"label"| B or A -->|label| B
+        r'^(\s*)(\w+)\s*(-->|<-->|-.->|---|-\.->)\s*\|"?([^"|]+)"?\|\s*(\w+)\s*$',
+        # Dotted with inline label: A -. "label" .- B (the second
+        # alternative leaves one space as the label of A -. .- B)
+        r'^(\s*)(\w+)\s*(-\.)(?:\s*(?!\s)|\s*(?=\s\S))"?([^"]+)(?:"\s*)?'
+        r'(\.-|-\.->)\s*(\w+)\s*$',
+        # Simple: A --> B
+        r'^(\s*)(\w+)\s*(-->|<-->|-.->|---|-\.->|<-\.->)\s*(\w+)\s*$',
+    )
+
+    CLASSDEF_PATTERN = _lazy_compile(
+        r'^(\s*)classDef\s+(\w+)\s+(.*?(?:\S|\s(?=;))|\s);?\s*$',
+        re.IGNORECASE
+    )
+
+    CLASS_APPLY_PATTERN = _lazy_compile(
+        r'^(\s*)class(?:\s+(?!\s)|\s+(?=\s\s\S))([\w,\s]+)\s(\w+);?\s*$',
+        re.IGNORECASE
+    )
+
+    LINKSTYLE_PATTERN = _lazy_compile(
+        r'^(\s*)linkStyle(?:\s+(?!\s)|\s+(?=\s\s\S)|\s+(?=\s{3}$))'
+        r'([\d,\s]+|default)\s+(.*?\S|\s)\s*$',
+        re.IGNORECASE
+    )
+
+    # Leading node ID; the character after it selects connection/node patterns
+    ID_PREFIX_PATTERN = _lazy_compile(r'(\s*)(\w+)\s*')
+
+    def parse(self, content: str, source_file: Path, start_line: int = 0) -> MermaidDiagram:
+        """Parse Mermaid content into structured representation."""
+        diagram = MermaidDiagram(
+            source_file=source_file,
+            start_line=start_line,
+            end_line=start_line,
+            raw_content=content
+        )
+
+        # Extract init block if present
+        init_match = self._find_init_block(content)
+        if init_match:
+            diagram.init_block = self._parse_init_block(init_match)
+            # Remove init blocks from content for further parsing; all of
+            # them, or a second one would only go on the next run
+            pieces = []
+            pos = 0
+            while init_match:
+                pieces.append(content[pos:init_match.start()])
+                pos = init_match.end()
+                init_match = self._find_init_block(content, pos)
+            content = ''.join(pieces) + content[pos:]
+
+        # Parse line by line
+        lines = content.split('\n')
+        current_indent = 0
+
+        for i, line in enumerate(lines):
+            line_num = start_line + i
+            stripped = line.strip()
+
+            if not stripped:
+                continue
+
+            # Calculate indent level
+            indent_spaces = len(line) - len(line.lstrip())
+            indent_level = indent_spaces // 4
+
+            element = self._parse_line(line, stripped, line_num, indent_level)
+            if element:
+                if isinstance(element, DiagramDeclaration):
+                    diagram.declaration = element
+                else:
+                    diagram.elements.append(element)
+
+        diagram.end_line = start_line + len(lines) - 1
+        return diagram
+
+    def _find_init_block(self, content: str, pos: int = 0) -> Optional[re.Match]:
+        """Find the first init block at or after pos, or None.
+
+        Same result as INIT_BLOCK_PATTERN.search(content, pos), but an
+        unterminated block is rejected with one scan instead of a scan to
+        the end of the diagram from every %%{init: in it.
+        """
+        start = self.INIT_START_PATTERN.search(content, pos)
+        if not start or not self.INIT_END_PATTERN.search(content, start.end() + 1):
+            return None
+        return self.INIT_BLOCK_PATTERN.match(content, start.start())
+
+    def _parse_init_block(self, match: re.Match) -> InitBlock:
+        """Parse the init block JSON.
+
+        The block comes from the document (or, with --server, an editor
+        buffer), so it is only ever read as data: as JSON, or failing that
+        as a Python literal for the single-quoted form Mermaid also accepts.
+        """
+        import ast
+        import json
+
+        init_block = InitBlock(raw_text=match.group(0))
+        json_str = match.group(1)
+        try:
+            data = json.loads(json_str)
+        except ValueError:
+            # Handle JavaScript-style booleans
+            json_str = json_str.replace('true', 'True').replace('false', 'False')
+            try:
+                data = ast.literal_eval(json_str)
+            except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+                return init_block  # Keep defaults
+        if isinstance(data, dict):
+            init_block.theme = data.get('theme', 'default')
+            init_block.theme_variables = data.get('themeVariables', {})
+        return init_block
+
+    def _parse_line(self, line: str, stripped: str, line_num: int,
+                    indent_level: int) -> Optional[DiagramElement]:
+        """Parse a single line into a DiagramElement.
+
+        Lines are classified in a single pass instead of trying every pattern
+        in turn. Keyword statements are dispatched on the first character of
+        the line; if that fails (or there is no keyword), the character that
+        follows the leading node ID selects the connection or node patterns.
+        A line therefore tries at most a handful of candidate patterns.
+        """
+        keyword_parser = self._KEYWORD_DISPATCH.get(stripped[0].casefold())
+        if keyword_parser:
+            element = keyword_parser(self, line, stripped, line_num, indent_level)
+            if element:
+                return element
+
+        prefix_match = self.ID_PREFIX_PATTERN.match(line)
+        if prefix_match:
+            next_char = line[prefix_match.end():prefix_match.end() + 1]
+
+            # Connections: the node ID is followed by an arrow
+            if next_char in ('-', '<'):
+                for pattern in self.CONNECTION_PATTERNS:
+                    conn_match = pattern.match(line)
+                    if conn_match:
+                        return self._parse_connection(conn_match, line, line_num, indent_level)
+
+            # Nodes: the node ID is followed by a shape (or nothing at all)
+            for pattern in self._NODE_DISPATCH.get(next_char, ()):
+                node_match = pattern.match(line)
+                if node_match:
+                    return self._parse_node(node_match, line, line_num, indent_level)
+
+        # Unrecognized - preserve as-is
+        return OtherLine(
+            element_type='other',
+            raw_text=line,
+            line_number=line_num,
+            indent_level=indent_level
+        )
+
+    def _parse_declaration(self, line: str, stripped: str, line_num: int,
+                           indent_level: int) -> Optional[DiagramElement]:
+        """Parse a diagram declaration: flowchart TB or graph LR."""
+        decl_match = self.DIAGRAM_DECL_PATTERN.match(stripped)
+        if decl_match:
+            return DiagramDeclaration(
+                element_type='declaration',
+                raw_text=line,
+                line_number=line_num,
+                indent_level=0,
+                diagram_type=decl_match.group(1).lower(),
+                direction=decl_match.group(2) or 'TB'
+            )
+        return None
+
+    def _parse_comment(self, line: str, stripped: str, line_num: int,
+                       indent_level: int) -> Optional[DiagramElement]:
+        """Parse a comment: %% text"""
+        comment_match = self.COMMENT_PATTERN.match(line)
+        if comment_match:
+            return Comment(
+                element_type='comment',
+                raw_text=line,
+                line_number=line_num,
+                indent_level=indent_level,
+                text=comment_match.group(2)
+            )
+        return None
+
+    def _parse_subgraph_start(self, line: str, stripped: str, line_num: int,
+                              indent_level: int) -> Optional[DiagramElement]:
+        """Parse a subgraph header: subgraph ID["Label"]"""
+        subgraph_match = self.SUBGRAPH_START_PATTERN.match(line)
+        if subgraph_match:
+            label = subgraph_match.group(3) or subgraph_match.group(4)
+            return SubgraphStart(
+                element_type='subgraph_start',
+                raw_text=line,
+                line_number=line_num,
+                indent_level=indent_level,
+                subgraph_id=sys.intern(subgraph_match.group(2)),
+                label=label
+            )
+        return None
+
+    def _parse_subgraph_end(self, line: str, stripped: str, line_num: int,
+                            indent_level: int) -> Optional[DiagramElement]:
+        """Parse the end keyword."""
+        if self.SUBGRAPH_END_PATTERN.match(line):
+            return SubgraphEnd(
+                element_type='subgraph_end',
+                raw_text=line,
+                line_number=line_num,
+                indent_level=indent_level
+            )
+        return None
+
+    def _parse_class_statement(self, line: str, stripped: str, line_num: int,
+                               indent_level: int) -> Optional[DiagramElement]:
+        """Parse classDef or class application statements."""
+        classdef_match = self.CLASSDEF_PATTERN.match(line)
+        if classdef_match:
+            return ClassDef(
+                element_type='classdef',
+                raw_text=line,
+                line_number=line_num,
+                indent_level=indent_level,
+                class_name=classdef_match.group(2),
+                properties=classdef_match.group(3).rstrip(';')
+            )
+
+        class_match = self.CLASS_APPLY_PATTERN.match(line)
+        if class_match:
+            nodes = [n.strip() for n in class_match.group(2).split(',')]
+            return ClassApplication(
+                element_type='class_apply',
+                raw_text=line,
+                line_number=line_num,
+                indent_level=indent_level,
+                node_ids=nodes,
+                class_name=class_match.group(3)
+            )
+        return None
+
+    def _parse_linkstyle(self, line: str, stripped: str, line_num: int,
+                         indent_level: int) -> Optional[DiagramElement]:
+        """Parse linkStyle indices properties."""
+        linkstyle_match = self.LINKSTYLE_PATTERN.match(line)
+        if linkstyle_match:
+            indices_str = linkstyle_match.group(2)
+            # Handle 'default' keyword vs numeric indices
+            if indices_str.lower() == 'default':
+                indices = []  # Empty list means 'default'
+            else:
+                indices = [int(i.strip()) for i in indices_str.split(',')]
+            return LinkStyle(
+                element_type='linkstyle',
+                raw_text=line,
+                line_number=line_num,
+                indent_level=indent_level,
+                indices=indices,
+                properties=linkstyle_match.group(3)
+            )
+        return None
+
+    # Keyword statements keyed by the (case-folded) first character of the
+    # line. Each keyword pattern is case-insensitive, so casefold() also
+    # covers characters such as the long s that IGNORECASE matches.
+    _KEYWORD_DISPATCH = {
+        'f': _parse_declaration,
+        'g': _parse_declaration,
+        '%': _parse_comment,
+        's': _parse_subgraph_start,
+        'e': _parse_subgraph_end,
+        'c': _parse_class_statement,
+        'l': _parse_linkstyle,
+    }
+
+    # Node patterns keyed by the character following the node ID, in the
+    # same priority order as NODE_PATTERNS
+    _NODE_DISPATCH = _Lazy(lambda: {
+        '(': MermaidParser.NODE_PATTERNS[0:1],
+        '[': MermaidParser.NODE_PATTERNS[1:5],
+        '': MermaidParser.NODE_PATTERNS[5:6],
+    })
+
+    def _parse_node(self, match: re.Match, line: str, line_num: int,
+                    indent_level: int) -> NodeDefinition:
+        """Parse a node definition."""
+        groups = match.groups()
+        node_id = sys.intern(groups[1])
+        label = groups[2] if len(groups) > 2 else None
+
+        # The shape is the one of the pattern that matched; looking for its
+        # markers anywhere in the line would also find them inside a label
+        shape_start, shape_end = self.NODE_SHAPES[self.NODE_PATTERNS.index(match.re)]
+
+        return NodeDefinition(
+            element_type='node',
+            raw_text=line,
+            line_number=line_num,
+            indent_level=indent_level,
+            node_id=node_id,
+            label=label,
+            shape_start=shape_start,
+            shape_end=shape_end
+        )
+
+    def _parse_connection(self, match: re.Match, line: str, line_num: int,
+                          indent_level: int) -> Connection:
+        """Parse a connection."""
+        groups = match.groups()
+
+        # Different patterns have different group structures
+        if len(groups) == 5:  # Labeled connection: A -->|label| B
+            source = groups[1]
+            arrow = groups[2]
+            label = groups[3]
+            target = groups[4]
+        elif len(groups) == 6:  # Dotted with label: A -. label .- B
+            source = groups[1]
+            arrow = groups[2] + groups[4]  # Combine -. and .-
+            label = groups[3]
+            target = groups[5]
+        else:  # Simple: A --> B
+            source = groups[1]
+            arrow = groups[2]
+            label = None
+            target = groups[3]
+
+        # Node IDs repeat across many edges; share one string per ID
+        return Connection(
+            element_type='connection',
+            raw_text=line,
+            line_number=line_num,
+            indent_level=indent_level,
+            source=sys.intern(source),
+            target=sys.intern(target),
+            arrow=arrow,
+            label=label
+        )
+
+
+# =============================================================================
+# Graph Index
+# =============================================================================
+
+class GraphIndex:
+    """Nodes, edges and subgraphs of one diagram, collected in a single pass.
+
+    Built once per diagram and shared by node classification, linkStyle
+    generation and lint, so none of them walks diagram.elements again.
+
+    - nodes: every node that is defined or used by an edge
+    - defined: node ID -> line number of its first definition
+    - declared_in: node ID -> subgraph it is first defined in, for nodes
+      defined inside a subgraph
+    - redeclared: node ID -> (line number, first subgraph, other subgraph)
+      for nodes also defined in a second subgraph
+    - edges: connections in order; an edge's position is its ordinal, the
+      index linkStyle statements refer to
+    - subgraph_ids: subgraph ID -> line number of its first header
+    - workflow_nodes: nodes styled workflowNode (see content_nodes)
+    - main_edges, workflow_edges, crossref_edges: edge ordinals by style
+    - other_lines: lines the parser left as OtherLine, for lint
+
+    Adjacency lists are only needed by lint, so adjacency() builds them
+    from edges on first use rather than slowing down every format.
+    """
+
+    __slots__ = ('nodes', 'defined', 'declared_in', 'redeclared', 'edges', 'subgraph_ids',
+                 'workflow_nodes', 'main_edges', 'workflow_edges', 'crossref_edges',
+                 'other_lines', '_adjacency')
+
+    # Statements the parser leaves as OtherLine but lint can still read:
+    # edge chains (A --> B --> C), fan-outs (A & B --> C) and endpoints
+    # with an inline shape (A["Label"] --> B). Quoted text and |labels|
+    # are dropped and each shape is reduced to '@' before matching.
+    _TEXT_PATTERN = _lazy_compile(r'"[^"]*"|\|[^|]*\|')
+    _SHAPE_PATTERN = _lazy_compile(r'[\[({][^\[\](){}]*[\])}]')
+    _STATEMENT_PATTERN = _lazy_compile(
+        r'\s*\w+@?(?::::\w+)?(?:\s*&\s*\w+@?(?::::\w+)?)*'
+        r'(?:\s*<?(?:-{2,}[->ox]|={2,}[=>ox]|-\.+-[>ox]?|~{3,})\s*'
+        r'\w+@?(?::::\w+)?(?:\s*&\s*\w+@?(?::::\w+)?)*)*\s*;?\s*'
+    )
+    _ARROW_PATTERN = _lazy_compile(r'<?(?:-{2,}[->ox]|={2,}[=>ox]|-\.+-[>ox]?|~{3,})')
+    _ARROW_HINT_PATTERN = _lazy_compile(r'--|==|-\.|~~~')
+
+    def __init__(self, diagram: MermaidDiagram):
+        self.nodes = set()
+        self.defined: Dict[str, int] = {}
+        self.declared_in: Dict[str, str] = {}
+        self.redeclared: Dict[str, Tuple[int, str, str]] = {}
+        self.edges: List[Connection] = []
+        self.subgraph_ids: Dict[str, int] = {}
+        self.workflow_nodes = set()
+        self.main_edges: List[int] = []
+        self.workflow_edges: List[int] = []
+        self.crossref_edges: List[int] = []
+        self.other_lines: List[OtherLine] = []
+        self._adjacency = None
+        self._build(diagram.elements)
+
+    def _build(self, elements: List[DiagramElement]):
+        # Huge diagrams are mostly edges, so the edge branch comes first and
+        # works on locals
+        nodes, edges = self.nodes, self.edges
+        main_edges, workflow_edges, crossref_edges = (
+            self.main_edges, self.workflow_edges, self.crossref_edges
+        )
+        # Subgraphs enclosing the current line, innermost last
+        stack: List[str] = []
+        in_workflow_subgraph = False
+
+        for element in elements:
+            if isinstance(element, Connection):
+                nodes.add(element.source)
+                nodes.add(element.target)
+                # linkStyle buckets, from template:
+                # - Cross-references (dotted with label -. ref .-): red dotted
+                # - Workflow/section jumps (dotted -.->): yellow dashed
+                # - Main arrows (solid -->, <-->, etc.): brand blue
+                arrow = element.arrow
+                if element.label and ('-.' in arrow or '.-' in arrow):
+                    crossref_edges.append(len(edges))
+                elif '-.>' in arrow or '-.->' in arrow:
+                    workflow_edges.append(len(edges))
+                else:
+                    main_edges.append(len(edges))
+                edges.append(element)
+            elif isinstance(element, NodeDefinition):
+                node_id = element.node_id
+                nodes.add(node_id)
+                self.defined.setdefault(node_id, element.line_number)
+                if stack:
+                    subgraph = stack[-1]
+                    first = self.declared_in.setdefault(node_id, subgraph)
+                    if first != subgraph and node_id not in self.redeclared:
+                        self.redeclared[node_id] = (element.line_number, first, subgraph)
+                if self._is_workflow_id(node_id) or in_workflow_subgraph:
+                    self.workflow_nodes.add(node_id)
+            elif isinstance(element, SubgraphStart):
+                self.subgraph_ids.setdefault(element.subgraph_id, element.line_number)
+                stack.append(element.subgraph_id)
+                # Track if we're entering a Workflow subgraph
+                if 'Workflow' in element.subgraph_id or (element.label and 'Workflow' in element.label):
+                    in_workflow_subgraph = True
+            elif isinstance(element, SubgraphEnd):
+                if stack:
+                    stack.pop()
+                # Any end leaves workflow mode, even when subgraphs are nested
+                in_workflow_subgraph = False
+            elif isinstance(element, OtherLine):
+                self.other_lines.append(element)
+
+    def adjacency(self) -> Tuple[Dict[str, List[int]], Dict[str, List[int]]]:
+        """Node ID -> ordinals of the edges leaving it, and entering it."""
+        if self._adjacency is None:
+            out_edges: Dict[str, List[int]] = {}
+            in_edges: Dict[str, List[int]] = {}
+            for ordinal, conn in enumerate(self.edges):
+                out_edges.setdefault(conn.source, []).append(ordinal)
+                in_edges.setdefault(conn.target, []).append(ordinal)
+            self._adjacency = out_edges, in_edges
+        return self._adjacency
+
+    @staticmethod
+    def _is_workflow_id(node_id: str) -> bool:
+        """Node IDs of 'W' followed by a number (W1, W2, etc.)."""
+        return node_id[:1] == 'W' and node_id[1:].isdecimal()
+
+    def content_nodes(self) -> set:
+        """Nodes styled chapter.
+
+        Based on mermaid_template_latest.mmd:
+        - chapter: Main content nodes (yellow border #F1D302)
+        - workflowNode: Workflow/process nodes (red border #C1292E)
+
+        Workflow nodes are defined nodes whose ID is 'W' followed by a
+        number, or that are defined inside a subgraph named 'Workflow'.
+        Content nodes are all other defined or referenced nodes.
+
+        Note: Subgraph IDs themselves are NOT styled - only nodes inside them.
+        """
+        return self.nodes - self.subgraph_ids.keys() - self.workflow_nodes
+
+    def _read_other_lines(self) -> Tuple[set, Dict[str, int], bool]:
+        """Nodes joined by edges in other_lines, and nodes defined there.
+
+        The third value is False if some line looks like an edge but could
+        not be read, so the nodes it joins are unknown.
+        """
+        joined = set()
+        defined: Dict[str, int] = {}
+        readable = True
+        for element in self.other_lines:
+            text = self._TEXT_PATTERN.sub('', element.raw_text)
+            # Innermost brackets first; shapes nest three deep at most, as in
+            # A(((Label))), so a fixed number of passes keeps this linear
+            for _ in range(3):
+                text = self._SHAPE_PATTERN.sub('@', text)
+            if not self._STATEMENT_PATTERN.fullmatch(text):
+                if self._ARROW_HINT_PATTERN.search(text):
+                    readable = False
+                continue
+            groups = self._ARROW_PATTERN.split(text.rstrip().rstrip(';'))
+            for group in groups:
+                for node in group.split('&'):
+                    node_id = node.strip().partition(':::')[0]
+                    if node_id.endswith('@'):
+                        node_id = node_id[:-1]
+                        defined.setdefault(node_id, element.line_number)
+                    if len(groups) > 1:
+                        joined.add(node_id)
+        return joined, defined, readable
+
+    def lint(self) -> List[Tuple[int, str]]:
+        """Check the graph; returns (line number, message) pairs in line order.
+
+        Finds edges to nodes that are never defined, defined nodes with no
+        edges, and nodes defined in more than one subgraph. Runs in
+        O(nodes + edges).
+
+        Edge statements the parser does not model are read from
+        other_lines; if one cannot be read, the undefined and no-edge
+        checks are skipped, as they could not be trusted. A diagram with
+        no edges at all only lays nodes out and is not checked for nodes
+        without edges.
+        """
+        out_edges, in_edges = self.adjacency()
+        joined, defined_elsewhere, readable = self._read_other_lines()
+        findings = []
+        undefined = self.nodes - self.defined.keys() - defined_elsewhere.keys() if readable else ()
+        for node_id in undefined:
+            if node_id in self.subgraph_ids:
+                continue  # Edges may point at a subgraph as a whole
+            first = self.edges[min(out_edges.get(node_id, [])[:1] + in_edges.get(node_id, [])[:1])]
+            findings.append((first.line_number,
+                             f"edge {first.source} {first.arrow} {first.target} "
+                             f"uses undefined node {node_id}"))
+        if readable and (self.edges or joined):
+            for node_id, line in self.defined.items():
+                if node_id not in out_edges and node_id not in in_edges and node_id not in joined:
+                    findings.append((line, f"node {node_id} has no edges"))
+        for node_id, (line, first, other) in self.redeclared.items():
+            findings.append((line, f"node {node_id} is declared in subgraphs {first} and {other}"))
+        findings.sort()
+        return findings
+
+
+# =============================================================================
+# Formatter
+# =============================================================================
+
+class _FormatRun:
+    """State of one MermaidFormatter.iter_lines call."""
+    __slots__ = ('index', 'depth', 'indent', 'seen_classdef', 'seen_class_apply',
+                 'seen_linkstyle')
+
+    def __init__(self, index: Optional[GraphIndex]):
+        self.index = index
+        self.depth = 0            # Subgraph nesting: 0 = top level
+        self.indent = INDENT      # One base indent plus one per open subgraph
+        self.seen_classdef = False
+        self.seen_class_apply = False
+        self.seen_linkstyle = False
+
+    def set_depth(self, depth: int):
+        self.depth = depth
+        self.indent = INDENT * (1 + depth)
+
+
+# Node shapes: opening bracket -> (opening, closing) around the quoted label;
+# anything else is a rectangle
+_NODE_SHAPES = {'([': ('(["', '"])'), '[/': ('[/"', '"/]'), '[\\': ('[\\"', '"\\]')}
+_RECTANGLE = ('["', '"]')
+
+
+class MermaidFormatter:
+    """Formats Mermaid diagrams according to style guide.
+
+    Each element is formatted by a handler looked up by its exact type in
+    a table built when the formatter is created, so an element costs one
+    dict lookup rather than a chain of isinstance checks. Line handlers
+    turn an element into its line at the current indent. Section handlers
+    cover subgraph boundaries and, with ENFORCE_STANDARD_COLORS, the
+    classDef, class and linkStyle statements that are replaced by the
+    standard ones; they update the run's state and emit zero or more lines.
+    """
+
+    def __init__(self):
+        # Element type -> handler(element, indent) -> line
+        self._line_handlers = {
+            Comment: self._format_comment,
+            NodeDefinition: self._format_node,
+            Connection: self._format_connection,
+            OtherLine: self._format_other,
+        }
+        # Element type -> handler(element, run) -> lines
+        self._section_handlers = {
+            SubgraphStart: self._subgraph_start,
+            SubgraphEnd: self._subgraph_end,
+        }
+        if ENFORCE_STANDARD_COLORS:
+            self._section_handlers.update({
+                ClassDef: self._standard_classdefs,
+                ClassApplication: self._standard_class_applications,
+                LinkStyle: self._standard_linkstyles,
+            })
+        else:
+            self._line_handlers.update({
+                ClassDef: self._format_classdef,
+                ClassApplication: self._format_class_application,
+                LinkStyle: self._format_linkstyle,
+            })
+
+    def format(self, diagram: MermaidDiagram, index: Optional[GraphIndex] = None) -> str:
+        """Format a diagram according to style rules."""
+        return '\n'.join(self.iter_lines(diagram, index))
+
+    def iter_lines(self, diagram: MermaidDiagram,
+                   index: Optional[GraphIndex] = None) -> Iterator[str]:
+        """Yield the formatted diagram one line at a time.
+
+        Lets validation stop at the first line that differs without
+        formatting the rest of the diagram. Pass index if the caller has
+        already built one for the diagram.
+        """
+        # 1. Init block - None means no init block (per template)
+        if CANONICAL_INIT_BLOCK is not None:
+            yield CANONICAL_INIT_BLOCK
+
+        # 2. Diagram declaration
+        if diagram.declaration:
+            decl = diagram.declaration
+            yield f"{decl.diagram_type} {decl.direction}"
+        else:
+            yield "flowchart TB"
+
+        # Node classes and edge ordinals for standard color enforcement
+        if ENFORCE_STANDARD_COLORS and index is None:
+            index = GraphIndex(diagram)
+
+        # 3. Format elements maintaining their order and structure
+        run = _FormatRun(index)
+        indent = run.indent
+        line_handlers = self._line_handlers
+        for element in diagram.elements:
+            handler = line_handlers.get(type(element))
+            if handler is not None:
+                yield handler(element, indent)
+                continue
+            yield from self._dispatch(element, run)
+            indent = run.indent
+
+        # If enforcing standard colors and no linkStyle was seen, add linkStyles at the end
+        if ENFORCE_STANDARD_COLORS and not run.seen_linkstyle and index.edges:
+            yield from self._generate_linkstyles(index)
+
+    def _dispatch(self, element: DiagramElement, run: _FormatRun) -> Iterable[str]:
+        """Format an element that has no line handler for its exact type."""
+        kind = type(element)
+        handler = self._section_handlers.get(kind)
+        if handler is not None:
+            return handler(element, run)
+
+        # First element of a subclass of a known type, or of an unknown type:
+        # remember its base class's handler (or the raw text fallback)
+        for base in kind.__mro__[1:]:
+            if base in self._section_handlers:
+                self._section_handlers[kind] = self._section_handlers[base]
+                return self._section_handlers[kind](element, run)
+            if base in self._line_handlers:
+                self._line_handlers[kind] = self._line_handlers[base]
+                break
+        else:
+            self._line_handlers[kind] = self._format_raw
+        return (self._line_handlers[kind](element, run.indent),)
+
+    # -- Section handlers -----------------------------------------------------
+
+    def _subgraph_start(self, element: SubgraphStart, run: _FormatRun) -> Iterator[str]:
+        # Subgraph header gets indent based on current depth
+        yield self._format_subgraph(element, run.indent)
+        run.set_depth(run.depth + 1)
+
+    def _subgraph_end(self, element: SubgraphEnd, run: _FormatRun) -> Iterator[str]:
+        # End keyword gets indent at the level of the subgraph it closes
+        run.set_depth(max(0, run.depth - 1))
+        yield run.indent + "end"
+
+    def _standard_classdefs(self, element: ClassDef, run: _FormatRun) -> Iterator[str]:
+        # Output standard classDef statements once (template uses 2 classes);
+        # original classDefs are dropped
+        if not run.seen_classdef:
+            run.seen_classdef = True
+            yield f"{INDENT}classDef chapter {STANDARD_CLASSDEFS['chapter']};"
+            yield f"{INDENT}classDef workflowNode {STANDARD_CLASSDEFS['workflowNode']};"
+
+    def _standard_class_applications(self, element: ClassApplication,
+                                     run: _FormatRun) -> Iterator[str]:
+        # Replace all class applications with the standard ones, once; the
+        # node sets are sorted here and nowhere else
+        if not run.seen_class_apply:
+            run.seen_class_apply = True
+            content_nodes = run.index.content_nodes()
+            if content_nodes:
+                yield f"{INDENT}class {','.join(sorted(content_nodes))} chapter;"
+            workflow_nodes = run.index.workflow_nodes
+            if workflow_nodes:
+                yield f"{INDENT}class {','.join(sorted(workflow_nodes))} workflowNode;"
+
+    def _standard_linkstyles(self, element: LinkStyle, run: _FormatRun) -> Iterator[str]:
+        # Generate linkStyle based on connection types, once
+        if not run.seen_linkstyle:
+            run.seen_linkstyle = True
+            yield from self._generate_linkstyles(run.index)
+
+    def _generate_linkstyles(self, index: GraphIndex) -> List[str]:
+        """Generate linkStyle directives from the index's edge buckets."""
+        linkstyles = []
+        for ordinals, style in ((index.main_edges, LINKSTYLE_MAIN),
+                                (index.workflow_edges, LINKSTYLE_WORKFLOW),
+                                (index.crossref_edges, LINKSTYLE_CROSSREF)):
+            if ordinals:
+                linkstyles.append(f"{INDENT}linkStyle {','.join(map(str, ordinals))} {style};")
+        return linkstyles
+
+    # -- Line handlers ----------------------------------------------------------
+
+    @staticmethod
+    def _format_comment(element: Comment, indent: str) -> str:
+        return f"{indent}%% {element.text}"
+
+    @staticmethod
+    def _format_node(element: NodeDefinition, indent: str) -> str:
+        # Ensure label is quoted; a label of nothing but quotes is dropped,
+        # as an empty one is
+        label = element.label.strip('"') if element.label else ''
+        if label:
+            opening, closing = _NODE_SHAPES.get(element.shape_start, _RECTANGLE)
+            return f'{indent}{element.node_id}{opening}{label}{closing}'
+        if element.node_id.lower() == 'end':
+            # A bare "end" would close a subgraph on the next run
+            return f"{indent}{element.raw_text.strip()}"
+        return f"{indent}{element.node_id}"
+
+    @staticmethod
+    def _format_connection(element: Connection, indent: str) -> str:
+        if not element.label:
+            return f"{indent}{element.source} {element.arrow} {element.target}"
+        if '-.' in element.arrow and '.-' in element.arrow:
+            # Dotted with inline label
+            return f'{indent}{element.source} -. "{element.label}" .- {element.target}'
+        # Standard labeled arrow
+        return f'{indent}{element.source} {element.arrow}|"{element.label}"| {element.target}'
+
+    @staticmethod
+    def _format_subgraph(element: SubgraphStart, indent: str) -> str:
+        # Quoted like node labels, so quotes already in the label don't pile up
+        label = element.label.strip('"') if element.label else ''
+        if label:
+            return f'{indent}subgraph {element.subgraph_id}["{label}"]'
+        return f"{indent}subgraph {element.subgraph_id}"
+
+    @staticmethod
+    def _format_classdef(element: ClassDef, indent: str) -> str:
+        props = element.properties.rstrip(';')
+        return f"{indent}classDef {element.class_name} {props};"
+
+    @staticmethod
+    def _format_class_application(element: ClassApplication, indent: str) -> str:
+        return f"{indent}class {','.join(element.node_ids)} {element.class_name};"
+
+    @staticmethod
+    def _format_linkstyle(element: LinkStyle, indent: str) -> str:
+        indices = ','.join(str(i) for i in element.indices)
+        return f"{indent}linkStyle {indices} {element.properties}"
+
+    @staticmethod
+    def _format_other(element: OtherLine, indent: str) -> str:
+        # Preserve original content but fix indentation
+        return f"{indent}{element.raw_text.strip()}"
+
+    @staticmethod
+    def _format_raw(element: DiagramElement, indent: str) -> str:
+        # Fallback for element types without a handler
+        return element.raw_text
+
+
+# =============================================================================
+# Profiling
+# =============================================================================
+
+PROFILE_PHASES = ('discovery', 'read', 'parse', 'format', 'diff', 'write')
+
+
+class _Phase:
+    """Context manager adding its wall and CPU time to a phase total."""
+    __slots__ = ('times', 'name', 'wall', 'cpu')
+
+    def __init__(self, times: Dict[str, List[float]], name: str):
+        self.times = times
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def __exit__(self, *exc_info):
+        total = self.times.setdefault(self.name, [0.0, 0.0])
+        total[0] += time.perf_counter() - self.wall
+        total[1] += time.process_time() - self.cpu
+
+
+class _NullPhase:
+    """Shared no-op context used when profiling is off."""
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class PhaseTimer:
+    """Accumulates wall and CPU time per named phase (for --profile)."""
+
+    def __init__(self, times: Optional[Dict[str, List[float]]] = None):
+        self.times = times if times is not None else {}
+
+    def phase(self, name: str):
+        return _Phase(self.times, name)
+
+
+class NullTimer:
+    """Stand-in for PhaseTimer that records nothing."""
+    _phase = _NullPhase()
+
+    def phase(self, name: str):
+        return self._phase
+
+
+NULL_TIMER = NullTimer()
+
+
+class ProfileReport:
+    """Per-phase totals and the slowest files and diagrams of a run.
+
+    Only the top entries are kept, so memory does not grow with the number
+    of files.
+    """
+
+    def __init__(self, top: int = 10):
+        self.top = top
+        self.timer = PhaseTimer()
+        self.slowest_files: List[Tuple[float, str]] = []
+        self.slowest_diagrams: List[Tuple[float, str, int]] = []
+
+    def add(self, result: FileResult):
+        """Fold a file's timings into the totals."""
+        for name, (wall, cpu) in result.timings.items():
+            total = self.timer.times.setdefault(name, [0.0, 0.0])
+            total[0] += wall
+            total[1] += cpu
+        if result.timings:
+            # Diff and write happen after processing, in the main process
+            wall = result.elapsed + sum(result.timings[name][0] for name in ('diff', 'write')
+                                        if name in result.timings)
+            self._push(self.slowest_files, (wall, str(result.file_path)))
+        for line, wall in result.diagram_times:
+            self._push(self.slowest_diagrams, (wall, str(result.file_path), line))
+
+    def _push(self, heap: list, item: tuple):
+        import heapq
+
+        if len(heap) < self.top:
+            heapq.heappush(heap, item)
+        else:
+            heapq.heappushpop(heap, item)
+
+    def print(self, elapsed: float):
+        print(f"\n{'=' * 60}")
+        print("Profile (seconds)")
+        print(f"{'=' * 60}")
+        print(f"{'Phase':<14}{'wall':>10}{'cpu':>10}")
+        times = self.timer.times
+        for name in PROFILE_PHASES:
+            wall, cpu = times.get(name, (0.0, 0.0))
+            print(f"{name:<14}{wall:>10.3f}{cpu:>10.3f}")
+        print(f"{'total (run)':<14}{elapsed:>10.3f}")
+
+        if self.slowest_files:
+            print("\nSlowest files:")
+            for wall, path in sorted(self.slowest_files, reverse=True):
+                print(f"  {wall * 1000:9.1f} ms  {path}")
+        if self.slowest_diagrams:
+            print("\nSlowest diagrams:")
+            for wall, path, line in sorted(self.slowest_diagrams, reverse=True):
+                print(f"  {wall * 1000:9.1f} ms  {path}:{line}")
+
+
+# =============================================================================
+# Diagram Types
+# =============================================================================
+
+def find_diagram_type(content: str) -> Tuple[str, int]:
+    """Return (first keyword, offset of its line) for a diagram body.
+
+    Blank lines, %% comments, %%{...}%% directives and --- front matter
+    before the declaration are skipped. ('', -1) means the body declares no
+    diagram type.
+    """
+    pos = 0
+    line_start = 0
+    length = len(content)
+    while pos < length:
+        end = content.find('\n', pos)
+        if end < 0:
+            end = length
+        text = content[pos:end].strip()
+        if text.startswith('%%{'):
+            # Directives may span lines; the declaration can follow on the
+            # line that closes one
+            close = content.find('}%%', pos)
+            if close < 0:
+                break
+            pos = close + 3
+            line_start = content.rfind('\n', 0, pos) + 1
+        elif not text or text.startswith('%%'):
+            pos = line_start = end + 1
+        elif text == '---':
+            # Front matter runs to the next --- line
+            pos = end + 1
+            while pos < length:
+                end = content.find('\n', pos)
+                if end < 0:
+                    end = length
+                if content[pos:end].strip() == '---':
+                    break
+                pos = end + 1
+            pos = line_start = end + 1
+        else:
+            return text.split(None, 1)[0].rstrip(';'), line_start
+    return '', -1
+
+
+class FlowchartPlugin:
+    """flowchart and graph diagrams, formatted per the style guide."""
+
+    def __init__(self):
+        self.parser = MermaidParser()
+        self.formatter = MermaidFormatter()
+
+    def iter_lines(self, content: str, file_path: Path, start_line: int = 0,
+                   timer=NULL_TIMER, warnings: Optional[List[str]] = None) -> Iterator[str]:
+        """Parse and index a diagram, returning its formatted lines.
+
+        Parsing happens before this returns; the lines are formatted as they
+        are consumed. Lint findings are appended to warnings unless it is
+        None.
+        """
+        with timer.phase('parse'):
+            diagram = self.parser.parse(content, file_path, start_line)
+            index = GraphIndex(diagram)
+        if warnings is not None:
+            # Element line numbers are 0-based
+            warnings.extend(f"line {line + 1}: {message}" for line, message in index.lint())
+        return self.formatter.iter_lines(diagram, index)
+
+
+class IndentPlugin:
+    """Diagram types with no style rules of their own: only indentation.
+
+    The declaration goes at column 0 and every other line gets one INDENT
+    per enclosing block, as in a formatted flowchart. Anything before the
+    declaration (front matter, directives, comments) is kept as is, blank
+    lines are emptied, and the text of a line is never changed. Subclasses
+    give the patterns for stripped lines that open a block, close one, or
+    separate two parts of one (shown at the block's own level, like else),
+    and for the first and last line of a text block such as a multi-line
+    note, whose lines are indented but not otherwise looked at.
+    """
+
+    OPEN_PATTERN = _lazy_compile(r'(?!)')
+    CLOSE_PATTERN = _lazy_compile(r'(?!)')
+    MIDDLE_PATTERN = _lazy_compile(r'(?!)')
+    TEXT_START_PATTERN = _lazy_compile(r'(?!)')
+    TEXT_END_PATTERN = _lazy_compile(r'(?!)')
+
+    def iter_lines(self, content: str, file_path: Path, start_line: int = 0,
+                   timer=NULL_TIMER, warnings: Optional[List[str]] = None) -> Iterator[str]:
+        """Return the re-indented lines of a diagram; see FlowchartPlugin."""
+        with timer.phase('parse'):
+            _, offset = find_diagram_type(content)
+        return self._iter_lines(content, offset)
+
+    def _iter_lines(self, content: str, offset: int) -> Iterator[str]:
+        if offset > 0:
+            yield from content[:offset - 1].split('\n')
+        end = content.find('\n', offset)
+        if end < 0:
+            end = len(content)
+        yield content[offset:end].strip()
+
+        depth = 0
+        blank = 0
+        in_text = False
+        for line in content[end + 1:].split('\n'):
+            stripped = line.strip()
+            if not stripped:
+                # Held back so trailing blank lines are dropped
+                blank += 1
+                continue
+            for _ in range(blank):
+                yield ''
+            blank = 0
+
+            if in_text:
+                if self.TEXT_END_PATTERN.match(stripped):
+                    in_text = False
+                    yield INDENT * (1 + depth) + stripped
+                else:
+                    yield INDENT * (2 + depth) + stripped
+                continue
+
+            if self.CLOSE_PATTERN.match(stripped):
+                depth = max(0, depth - 1)
+                level = depth
+            elif self.MIDDLE_PATTERN.match(stripped):
+                level = max(0, depth - 1)
+            else:
+                level = depth
+            yield INDENT * (1 + level) + stripped
+            if self.TEXT_START_PATTERN.match(stripped):
+                in_text = True
+            elif self.OPEN_PATTERN.match(stripped):
+                depth += 1
+
+
+class SequencePlugin(IndentPlugin):
+    """sequenceDiagram: loop, alt, opt, par, critical, break, rect and box
+    blocks, closed by end."""
+
+    OPEN_PATTERN = _lazy_compile(r'(?:loop|alt|opt|par|par_over|critical|break|rect|box)(?:\s|$)')
+    CLOSE_PATTERN = _lazy_compile(r'end$')
+    MIDDLE_PATTERN = _lazy_compile(r'(?:else|and|option)(?:\s|$)')
+
+
+class StatePlugin(IndentPlugin):
+    """stateDiagram and stateDiagram-v2: composite states ({ ... }) and
+    multi-line notes (note ... end note)."""
+
+    OPEN_PATTERN = _lazy_compile(r'(?!%%).*\{$')
+    CLOSE_PATTERN = _lazy_compile(r'\}')
+    TEXT_START_PATTERN = _lazy_compile(r'note\s[^:]*$')
+    TEXT_END_PATTERN = _lazy_compile(r'end note$')
+
+
+class ClassDiagramPlugin(IndentPlugin):
+    """classDiagram: class and namespace bodies ({ ... })."""
+
+    OPEN_PATTERN = _lazy_compile(r'(?!%%).*\{$')
+    CLOSE_PATTERN = _lazy_compile(r'\}')
+
+
+# First keyword of a diagram -> plugin for that diagram type. A plugin is
+# only instantiated, and its patterns compiled, when the first diagram of
+# its type is seen; diagrams of any other type are left untouched. Keys are
+# lower case: keywords match case-insensitively, like flowchart declarations.
+DIAGRAM_TYPES = {
+    'flowchart': FlowchartPlugin,
+    'graph': FlowchartPlugin,
+    'sequencediagram': SequencePlugin,
+    'statediagram': StatePlugin,
+    'statediagram-v2': StatePlugin,
+    'classdiagram': ClassDiagramPlugin,
+}
+
+
+# =============================================================================
+# Markdown Processor
+# =============================================================================
+
+@dataclass
+class MermaidBlock:
+    """A fenced mermaid code block found by scan_markdown."""
+    opening: str       # Opening fence line, e.g. "```mermaid\n"
+    body: str          # Body lines exactly as they appear in the file
+    closing: str       # Closing fence line
+    indent: str        # Indentation of the opening fence (e.g. inside a list)
+    content: str       # Body with the fence indentation removed
+    start_line: int    # 0-based line number of the opening fence
+    start: int = 0     # Offset of the first body character
+    end: int = 0       # Offset just past the last body line
+
+    def line_span(self) -> Tuple[int, int]:
+        """1-based line numbers of the opening and closing fences."""
+        return self.start_line + 1, self.start_line + self.body.count('\n') + 2
+
+
+def _match_fence(line: str) -> Optional[Tuple[str, str, int, str]]:
+    """Match a fence line, returning (indent, fence_char, length, info) or None."""
+    stripped = line.lstrip(' \t')
+    fence_char = stripped[:1]
+    if fence_char != '`' and fence_char != '~':
+        return None
+    rest = stripped.lstrip(fence_char)
+    length = len(stripped) - len(rest)
+    if length < 3:
+        return None
+    info = rest.strip()
+    # Backtick fences cannot have backticks in their info string
+    if fence_char == '`' and '`' in info:
+        return None
+    return line[:len(line) - len(stripped)], fence_char, length, info
+
+
+# Any line that could open a mermaid fence: three backticks or tildes with
+# "mermaid" later on the same line. A superset of what scan_markdown accepts,
+# so the prefilter never skips a file that has a diagram.
+MERMAID_FENCE_BYTES = rb'(?:```|~~~)[^\n]*?mermaid'
+
+# Files at least this large are searched through mmap instead of read()
+PREFILTER_MMAP_SIZE = 1024 * 1024
+
+
+def has_mermaid_fence(data) -> bool:
+    """Check raw bytes (or an mmap) for a possible mermaid fence."""
+    # find() rather than `in`: on an mmap, `in` only looks for a single byte
+    return data.find(b'mermaid') >= 0 and re.search(MERMAID_FENCE_BYTES, data) is not None
+
+
+def may_contain_mermaid(file_path: Path) -> bool:
+    """Cheap byte-level check for whether a file could hold a mermaid block.
+
+    Looks for a mermaid fence in the raw bytes without decoding the file;
+    large files are mapped rather than read. Unreadable files return True
+    so the normal path reports the error.
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < PREFILTER_MMAP_SIZE:
+                return has_mermaid_fence(f.read())
+            import mmap
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return has_mermaid_fence(data)
+    except (OSError, ValueError):
+        return True
+
+
+def decode_markdown(data: bytes) -> str:
+    """Decode a file's bytes the way read_text() would (UTF-8, universal newlines)."""
+    content = data.decode('utf-8')
+    if '\r' in content:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return content
+
+
+def iter_lines(content: str) -> Iterator[str]:
+    """Yield the lines of content, keeping their '\\n' line endings."""
+    start = 0
+    length = len(content)
+    while start < length:
+        end = content.find('\n', start)
+        if end < 0:
+            yield content[start:]
+            return
+        yield content[start:end + 1]
+        start = end + 1
+
+
+def scan_markdown(lines: Iterable[str]) -> Iterator[object]:
+    """Scan Markdown lines for fenced mermaid blocks.
+
+    Yields each line outside a mermaid block unchanged (as a str) and each
+    closed mermaid block as a MermaidBlock. Fences follow CommonMark rules:
+    backtick or tilde fences of three or more characters, closed by a fence
+    of the same character that is at least as long. The info string only
+    has to start with "mermaid" (e.g. "```mermaid title"), and fences may be
+    indented, e.g. inside list items. Other fenced blocks are passed through,
+    so mermaid examples nested inside them are left alone. Unclosed mermaid
+    blocks are passed through untouched.
+
+    Only the body of the current mermaid block is buffered, so memory stays
+    proportional to the largest diagram rather than the whole document.
+    """
+    offset = 0
+    fence = None  # (fence_char, length) of an open non-mermaid fence
+    block = None  # (opening, indent, fence_char, length, start_line, start)
+    body: List[str] = []
+
+    for line_num, line in enumerate(lines):
+        line_start = offset
+        offset += len(line)
+
+        if block is not None:
+            opening, indent, fence_char, length, start_line, start = block
+            stripped = line.strip()
+            if (stripped[:1] == fence_char and len(stripped) >= length
+                    and stripped == fence_char * len(stripped)):
+                raw_body = ''.join(body)
+                if indent:
+                    content = ''.join(_dedent_line(l, len(indent)) for l in body)
+                else:
+                    content = raw_body
+                yield MermaidBlock(
+                    opening=opening,
+                    body=raw_body,
+                    closing=line,
+                    indent=indent,
+                    content=content,
+                    start_line=start_line,
+                    start=start,
+                    end=line_start
+                )
+                block = None
+                body = []
+            else:
+                body.append(line)
+            continue
+
+        fence_match = _match_fence(line)
+        if fence is not None:
+            # Inside a non-mermaid fence: only look for its closing fence
+            if (fence_match and fence_match[1] == fence[0] and fence_match[2] >= fence[1]
+                    and not fence_match[3]):
+                fence = None
+            yield line
+        elif fence_match is None:
+            yield line
+        else:
+            indent, fence_char, length, info = fence_match
+            if info.split(None, 1)[:1] == ['mermaid']:
+                block = (line, indent, fence_char, length, line_num, offset)
+            else:
+                fence = (fence_char, length)
+                yield line
+
+    if block is not None:
+        # Unclosed mermaid fence: leave it exactly as it was
+        yield block[0]
+        yield from body
+
+
+def _dedent_line(line: str, width: int) -> str:
+    """Remove up to width characters of leading indentation from line."""
+    indentation = len(line) - len(line.lstrip(' \t'))
+    return line[min(width, indentation):]
+
+
+def lines_match(expected: str, lines: Iterable[str]) -> bool:
+    """Check whether '\n'.join(lines).strip() == expected.strip().
+
+    lines is consumed lazily and the comparison stops at the first line that
+    cannot match, so a non-conforming diagram is rejected without formatting
+    the rest of it.
+    """
+    expected_lines = expected.strip().split('\n')
+    last = len(expected_lines) - 1
+    lines = iter(lines)
+
+    # Leading blank lines and indentation are removed by strip()
+    for line in lines:
+        if line.strip():
+            first = line.lstrip()
+            break
+    else:
+        return expected_lines == ['']
+
+    matched = 0
+    for line in chain((first,), lines):
+        if matched < last:
+            if line != expected_lines[matched]:
+                return False
+        elif matched == last:
+            # Trailing whitespace only matters before the last line
+            if line.rstrip() != expected_lines[last]:
+                return False
+        elif line.strip():
+            return False
+        matched += 1
+    return matched > last
+
+
+class DiagramMemo:
+    """Bounded LRU cache of formatted diagrams keyed by a content hash.
+
+    The same diagram is often pasted into many guides; identical blocks are
+    parsed and formatted once per run. A maxsize of 0 disables the memo.
+    Entries added by check_block hold only the changed flag (formatted is
+    None).
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_MEMO_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def key(content: str) -> bytes:
+        import hashlib
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+    def get(self, key: bytes) -> Optional[Tuple[str, bool]]:
+        """Return (formatted, changed) for key, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: bytes, formatted: str, changed: bool):
+        self._entries[key] = (formatted, changed)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+
+class MarkdownProcessor:
+    """Extracts and replaces Mermaid blocks in Markdown files."""
+
+    def __init__(self, stream_threshold: Optional[int] = None, write_streamed: bool = False,
+                 memo_size: int = DEFAULT_MEMO_SIZE, profile: bool = False,
+                 check_only: bool = False, fsync: bool = False, lint: bool = False):
+        """stream_threshold: files of at least this many bytes are processed
+        with stream_file instead of being loaded into memory.
+        write_streamed: write streamed files in place (otherwise they are
+        only checked).
+        memo_size: number of formatted diagrams to remember across files.
+        profile: record phase and per-diagram timings on each FileResult.
+        check_only: process_file only checks conformance (see check_file).
+        fsync: make streamed files durable before replacing the original.
+        lint: check each diagram's graph and report findings as warnings;
+        disables the memo, whose hits would skip the check.
+        """
+        # Plugin class -> instance, created when its first diagram is seen
+        self.plugins: Dict[type, object] = {}
+        self.stream_threshold = stream_threshold
+        self.write_streamed = write_streamed
+        self.memo = DiagramMemo(memo_size) if memo_size > 0 and not lint else None
+        self.profile = profile
+        self.check_only = check_only
+        self.fsync = fsync
+        self.lint = lint
+
+    def find_mermaid_blocks(self, content: str) -> List[MermaidBlock]:
+        """Find all Mermaid code blocks with their positions.
+
+        Returns a list of MermaidBlock objects; start and end delimit the
+        block body within content.
+        """
+        return [item for item in scan_markdown(iter_lines(content))
+                if isinstance(item, MermaidBlock)]
+
+    def _plugin_for(self, block: MermaidBlock):
+        """The plugin for a block's diagram type, or None to leave it as is."""
+        keyword, _ = find_diagram_type(block.content)
+        plugin_class = DIAGRAM_TYPES.get(keyword.lower())
+        if plugin_class is None:
+            return None
+        plugin = self.plugins.get(plugin_class)
+        if plugin is None:
+            plugin = self.plugins[plugin_class] = plugin_class()
+        return plugin
+
+    def _iter_formatted(self, plugin, block: MermaidBlock, file_path: Path, timer,
+                        warnings: Optional[List[str]]) -> Iterator[str]:
+        return plugin.iter_lines(block.content, file_path, block.start_line + 1, timer,
+                                 warnings if self.lint else None)
+
+    def format_block(self, block: MermaidBlock, file_path: Path, timer=NULL_TIMER,
+                     warnings: Optional[List[str]] = None) -> Tuple[str, bool]:
+        """Format a block, returning (new body text, changed flag).
+
+        The new body is re-indented to the fence indentation and ends with a
+        newline, ready to be placed between the opening and closing fences.
+        Identical diagrams seen earlier in the run are taken from the memo.
+        Diagrams of a type with no plugin are returned unchanged. With lint
+        enabled, findings are appended to warnings.
+        """
+        plugin = self._plugin_for(block)
+        if plugin is None:
+            return block.body, False
+
+        memo_key = None
+        cached = None
+        if self.memo is not None:
+            memo_key = self.memo.key(block.content)
+            cached = self.memo.get(memo_key)
+
+        if cached is not None and cached[0] is not None:
+            formatted, changed = cached
+        else:
+            # Parse the diagram, then format it
+            lines = self._iter_formatted(plugin, block, file_path, timer, warnings)
+            with timer.phase('format'):
+                formatted = '\n'.join(lines)
+
+            # Check if changed
+            # Normalize for comparison (strip trailing whitespace)
+            changed = block.content.strip() != formatted.strip()
+
+            if memo_key is not None:
+                self.memo.put(memo_key, formatted, changed)
+
+        if block.indent:
+            formatted = '\n'.join(
+                block.indent + line if line else line
+                for line in formatted.split('\n')
+            )
+        return formatted + '\n', changed
+
+    def check_block(self, block: MermaidBlock, file_path: Path, timer=NULL_TIMER,
+                    warnings: Optional[List[str]] = None) -> bool:
+        """Return True if a block is not in canonical form.
+
+        Formatted lines are compared with the block as they are produced, so
+        formatting stops at the first difference. With lint enabled,
+        findings are appended to warnings.
+        """
+        plugin = self._plugin_for(block)
+        if plugin is None:
+            return False
+
+        memo_key = None
+        if self.memo is not None:
+            memo_key = self.memo.key(block.content)
+            cached = self.memo.get(memo_key)
+            if cached is not None:
+                return cached[1]
+
+        lines = self._iter_formatted(plugin, block, file_path, timer, warnings)
+        with timer.phase('format'):
+            changed = not lines_match(block.content, lines)
+
+        if memo_key is not None:
+            self.memo.put(memo_key, None, changed)
+        return changed
+
+    def check_file(self, file_path: Path, data: Optional[bytes] = None) -> FileResult:
+        """Check a Markdown file's diagrams without formatting the file.
+
+        The file is scanned line by line and only one diagram is held in
+        memory at a time; no formatted document is built and the result
+        carries no file content. Counts, errors and spans match what
+        process_file would report.
+        """
+        result = FileResult(
+            file_path=file_path,
+            diagrams_found=0,
+            diagrams_changed=0,
+            original_content="",
+            formatted_content=""
+        )
+        timer = PhaseTimer(result.timings) if self.profile else NULL_TIMER
+        with timer.phase('read'):
+            if not (has_mermaid_fence(data) if data is not None
+                    else may_contain_mermaid(file_path)):
+                return result
+        memo_stats = self._memo_stats()
+        try:
+            if data is not None:
+                with timer.phase('read'):
+                    lines = iter_lines(decode_markdown(data))
+                self._check_lines(lines, result, timer)
+            else:
+                # The fence check above has read the file once; the lines
+                # read here come from the page cache
+                with open(file_path, encoding='utf-8') as src:
+                    self._check_lines(src, result, timer)
+        except Exception as e:
+            # Report unreadable files the same way process_file does
+            result = FileResult(file_path, 0, 0, "", "", errors=[f"Failed to read file: {e}"])
+
+        self._record_memo_stats(result, memo_stats)
+        return result
+
+    def _check_lines(self, lines: Iterable[str], result: FileResult, timer):
+        """Check the diagrams in a file's lines, adding them up on result."""
+        for item in scan_markdown(lines):
+            if not isinstance(item, MermaidBlock):
+                continue
+
+            result.diagrams_found += 1
+            changed = False
+            if self.profile:
+                started = time.perf_counter()
+            try:
+                changed = self.check_block(item, result.file_path, timer, result.warnings)
+            except Exception as e:
+                result.errors.append(
+                    f"Failed to format diagram at line {item.start_line + 1}: {e}"
+                )
+            if self.profile:
+                result.diagram_times.append(
+                    (item.start_line + 1, time.perf_counter() - started)
+                )
+            result.diagrams_changed += changed
+            result.spans.append(item.line_span() + (changed,))
+
+    def process_file(self, file_path: Path, data: Optional[bytes] = None) -> FileResult:
+        """Process a Markdown file, formatting all Mermaid blocks.
+
+        data is the file's content if the caller has already read it (see
+        prefetch_files); the file is then not opened again.
+        """
+        started = time.perf_counter()
+        if self.check_only:
+            result = self.check_file(file_path, data)
+        else:
+            result = self._process_file(file_path, data)
+        result.elapsed = time.perf_counter() - started
+        return result
+
+    def _process_file(self, file_path: Path, data: Optional[bytes] = None) -> FileResult:
+        if data is None and self.stream_threshold is not None:
+            try:
+                size = file_path.stat().st_size
+            except OSError:
+                size = 0
+            if size >= self.stream_threshold:
+                return self.stream_file(file_path, write=self.write_streamed)
+
+        result = FileResult(
+            file_path=file_path,
+            diagrams_found=0,
+            diagrams_changed=0,
+            original_content="",
+            formatted_content=""
+        )
+        timer = PhaseTimer(result.timings) if self.profile else NULL_TIMER
+
+        try:
+            with timer.phase('read'):
+                if data is None:
+                    data = file_path.read_bytes()
+                # Most pages have no diagrams: skip them before decoding
+                if not has_mermaid_fence(data):
+                    return result
+                content = decode_markdown(data)
+        except Exception as e:
+            result.errors.append(f"Failed to read file: {e}")
+            return result
+        del data
+
+        result.original_content = content
+        blocks = self.find_mermaid_blocks(content)
+        result.diagrams_found = len(blocks)
+
+        if not blocks:
+            result.formatted_content = content
+            return result
+
+        # Collect unchanged spans and formatted bodies in one forward pass
+        # and join them once, so each byte of the file is copied only once
+        memo_stats = self._memo_stats()
+        segments = []
+        position = 0
+        size = 0  # Length of the formatted document so far
+        for block in blocks:
+            if self.profile:
+                started = time.perf_counter()
+            try:
+                formatted_body, changed = self.format_block(block, file_path, timer,
+                                                            result.warnings)
+            except Exception as e:
+                result.errors.append(
+                    f"Failed to format diagram at line {block.start_line + 1}: {e}"
+                )
+                result.spans.append(block.line_span() + (False,))
+                continue
+            finally:
+                if self.profile:
+                    result.diagram_times.append(
+                        (block.start_line + 1, time.perf_counter() - started)
+                    )
+            result.spans.append(block.line_span() + (changed,))
+
+            if changed:
+                result.diagrams_changed += 1
+            segments.append(content[position:block.start])
+            size += block.start - position
+            if formatted_body != block.body:
+                result.edits.append((block.start, block.end, size, size + len(formatted_body),
+                                     block.start_line + 1))
+            segments.append(formatted_body)
+            size += len(formatted_body)
+            position = block.end
+        segments.append(content[position:])
+
+        result.formatted_content = ''.join(segments)
+        self._record_memo_stats(result, memo_stats)
+        return result
+
+    def _memo_stats(self) -> Tuple[int, int]:
+        if self.memo is None:
+            return 0, 0
+        return self.memo.hits, self.memo.misses
+
+    def _record_memo_stats(self, result: FileResult, before: Tuple[int, int]):
+        """Store the memo hits and misses since before on result."""
+        hits, misses = self._memo_stats()
+        result.memo_hits = hits - before[0]
+        result.memo_misses = misses - before[1]
+
+    def stream_file(self, file_path: Path, write: bool = False) -> FileResult:
+        """Process a Markdown file without loading it into memory.
+
+        The file is read line by line; text outside mermaid blocks is copied
+        straight to the output and only one diagram is buffered at a time.
+        With write=True the output goes to a temporary file next to the
+        original, which replaces it only if a diagram changed. The returned
+        result carries no file content.
+        """
+        result = FileResult(
+            file_path=file_path,
+            diagrams_found=0,
+            diagrams_changed=0,
+            original_content="",
+            formatted_content="",
+            streamed=True
+        )
+        if not may_contain_mermaid(file_path):
+            return result
+
+        out = None
+        tmp_path = None
+        writer = FileWriter(fsync=self.fsync)
+        memo_stats = self._memo_stats()
+        timer = PhaseTimer(result.timings) if self.profile else NULL_TIMER
+        try:
+            with open(file_path, encoding='utf-8') as src:
+                if write:
+                    fd, tmp_path = writer.open_temp(file_path)
+                    out = os.fdopen(fd, 'w', encoding='utf-8')
+
+                for item in scan_markdown(src):
+                    if not isinstance(item, MermaidBlock):
+                        if out:
+                            out.write(item)
+                        continue
+
+                    result.diagrams_found += 1
+                    body = item.body
+                    changed = False
+                    if self.profile:
+                        started = time.perf_counter()
+                    try:
+                        body, changed = self.format_block(item, file_path, timer,
+                                                          result.warnings)
+                        if changed:
+                            result.diagrams_changed += 1
+                    except Exception as e:
+                        result.errors.append(
+                            f"Failed to format diagram at line {item.start_line + 1}: {e}"
+                        )
+                    if self.profile:
+                        result.diagram_times.append(
+                            (item.start_line + 1, time.perf_counter() - started)
+                        )
+                    result.spans.append(item.line_span() + (changed,))
+                    if out:
+                        out.write(item.opening)
+                        out.write(body)
+                        out.write(item.closing)
+
+            if out:
+                out.close()
+                out = None
+                if result.diagrams_changed and not result.errors:
+                    writer.install(tmp_path, file_path)
+                    tmp_path = None
+                    writer.commit(raise_errors=True)
+                    result.written = True
+        except Exception as e:
+            result.errors.append(f"Failed to process file: {e}")
+        finally:
+            if out:
+                out.close()
+            if tmp_path:
+                _unlink_quietly(tmp_path)
+
+        self._record_memo_stats(result, memo_stats)
+        return result
+
+
+# =============================================================================
+# File Output
+# =============================================================================
+
+def _unlink_quietly(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+class FileWriter:
+    """Writes formatted files atomically.
+
+    New content goes to a temporary file in the same directory, which gets
+    the original's permission bits and is moved over it with os.replace, so
+    an interrupted run never leaves a truncated file. A symlinked file is
+    written through: its target is replaced and the link is left as it
+    is. Files whose bytes would not change are left alone, keeping their
+    mtime (and Jekyll's rebuilds) untouched.
+
+    With fsync=True, replacements are held until commit(): all temporary
+    files are fsynced together, moved into place, and each directory is
+    fsynced once, instead of stalling on one fsync per file mid-run. Used as
+    a context manager, pending files are committed on exit (failures are
+    collected in errors) and removed if the run is interrupted.
+    """
+
+    def __init__(self, fsync: bool = False):
+        self.fsync = fsync
+        self.errors: List[str] = []  # Commit failures when used as a context manager
+        self._pending: List[Tuple[str, Path]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.errors.extend(self.commit())
+        else:
+            self.discard()
+
+    @staticmethod
+    def target(file_path: Path) -> Path:
+        """The file that writes to file_path replace, with symlinks resolved."""
+        return Path(os.path.realpath(file_path))
+
+    @classmethod
+    def open_temp(cls, file_path: Path) -> Tuple[int, str]:
+        """Create a temporary file next to file_path's target; returns (fd, path)."""
+        import tempfile
+        target = cls.target(file_path)
+        return tempfile.mkstemp(dir=target.parent, prefix=f'.{target.name}.', suffix='.tmp')
+
+    def install(self, tmp_path: str, file_path: Path):
+        """Move a finished temporary file over file_path's target (or queue it)."""
+        file_path = self.target(file_path)
+        os.chmod(tmp_path, file_path.stat().st_mode & 0o7777)
+        if self.fsync:
+            self._pending.append((tmp_path, file_path))
+        else:
+            os.replace(tmp_path, file_path)
+
+    def write(self, file_path: Path, text: str) -> bool:
+        """Atomically replace file_path with text.
+
+        Returns False, without touching the file, if it already holds
+        exactly these bytes.
+        """
+        if os.linesep != '\n':
+            # Same newline translation as Path.write_text()
+            text = text.replace('\n', os.linesep)
+        data = text.encode('utf-8')
+        if os.stat(file_path).st_size == len(data):
+            with open(file_path, 'rb') as f:
+                if f.read() == data:
+                    return False
+
+        fd, tmp_path = self.open_temp(file_path)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                out.write(data)
+            self.install(tmp_path, file_path)
+        except BaseException:
+            _unlink_quietly(tmp_path)
+            raise
+        return True
+
+    def commit(self, raise_errors: bool = False) -> List[str]:
+        """fsync and move pending files into place.
+
+        Returns an error message for each file that could not be replaced
+        (or raises the first error with raise_errors=True).
+        """
+        pending, self._pending = self._pending, []
+        errors = []
+        directories = set()
+        for tmp_path, file_path in pending:
+            try:
+                fd = os.open(tmp_path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                errors.append((tmp_path, file_path, e))
+        failed = {tmp_path for tmp_path, _, _ in errors}
+        for tmp_path, file_path in pending:
+            if tmp_path in failed:
+                continue
+            try:
+                os.replace(tmp_path, file_path)
+                directories.add(file_path.parent)
+            except OSError as e:
+                errors.append((tmp_path, file_path, e))
+        for directory in directories:
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+            except OSError:
+                continue  # Directories cannot be opened on some platforms
+            try:
+                os.fsync(fd)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+        for tmp_path, _, _ in errors:
+            _unlink_quietly(tmp_path)
+        if errors and raise_errors:
+            raise errors[0][2]
+        return [f"{file_path}: Failed to write file: {e}" for _, file_path, e in errors]
+
+    def discard(self):
+        """Remove pending temporary files, leaving the originals in place."""
+        pending, self._pending = self._pending, []
+        for tmp_path, _ in pending:
+            _unlink_quietly(tmp_path)
+
+
+# =============================================================================
+# Result Cache
+# =============================================================================
+
+def ruleset_key() -> str:
+    """Hash of everything that determines formatting output.
+
+    Covers the formatter version, the style configuration and the source
+    of this module, so any change to the rules invalidates cached results.
+    """
+    import hashlib
+    import json
+
+    digest = hashlib.sha256()
+    config = {
+        'version': FORMATTER_VERSION,
+        'init_block': CANONICAL_INIT_BLOCK,
+        'indent': INDENT,
+        'classdefs': STANDARD_CLASSDEFS,
+        'linkstyles': [LINKSTYLE_MAIN, LINKSTYLE_WORKFLOW, LINKSTYLE_CROSSREF],
+        'enforce_colors': ENFORCE_STANDARD_COLORS,
+    }
+    digest.update(json.dumps(config, sort_keys=True).encode('utf-8'))
+    try:
+        digest.update(Path(__file__).read_bytes())
+    except OSError:
+        pass
+    return digest.hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    """Return the SHA-256 hex digest of data."""
+    import hashlib
+    return hashlib.sha256(data).hexdigest()
+
+
+# Files are hashed in chunks of this size, so hashing a huge page does not
+# load it whole
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: Path) -> str:
+    """Return the SHA-256 hex digest of a file's raw bytes."""
+    import hashlib
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """On-disk cache of per-file conformance results keyed by content hash.
+
+    Entries are only trusted when the ruleset key that produced them matches
+    the running script. The cache file is replaced atomically, so parallel or
+    interrupted runs never leave a partially written cache behind. Runs with
+    lint use a cache file of their own, since only they record warnings.
+    """
+
+    FILENAME = 'results.json'
+    LINT_FILENAME = 'results-lint.json'
+
+    def __init__(self, cache_dir: Path, lint: bool = False):
+        self.path = cache_dir / (self.LINT_FILENAME if lint else self.FILENAME)
+        self.key = ruleset_key()
+        self.entries: Dict[str, dict] = {}
+        self.hits = 0
+        self._digests: Dict[str, str] = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        import json
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get('key') == self.key:
+            files = data.get('files')
+            if isinstance(files, dict):
+                self.entries = files
+
+    @staticmethod
+    def _entry_key(file_path: Path) -> str:
+        return os.path.abspath(file_path)
+
+    def lookup(self, file_path: Path, allow_changed: bool = False,
+               data: Optional[bytes] = None) -> Optional[FileResult]:
+        """Return the cached result for an unchanged file, or None.
+
+        Results for files that need formatting are only returned when
+        allow_changed is set (validation without a diff), since formatting
+        and diffing need the file content. data is the file's content if it
+        has already been read.
+        """
+        key = self._entry_key(file_path)
+        try:
+            digest = hash_file(file_path) if data is None else hash_bytes(data)
+        except OSError:
+            return None
+        self._digests[key] = digest
+
+        entry = self.entries.get(key)
+        if not entry or entry.get('hash') != digest:
+            return None
+        if entry['diagrams_changed'] and not allow_changed:
+            return None
+
+        self.hits += 1
+        return FileResult(
+            file_path=file_path,
+            diagrams_found=entry['diagrams_found'],
+            diagrams_changed=entry['diagrams_changed'],
+            original_content="",
+            formatted_content="",
+            errors=list(entry.get('errors', [])),
+            warnings=list(entry.get('warnings', [])),
+            cached=True,
+            spans=[tuple(span) for span in entry.get('spans', [])]
+        )
+
+    def store(self, result: FileResult):
+        """Record the result of processing a file looked up earlier.
+
+        The lists are copied: results are stored before they are written,
+        and a failed write must not end up in the cache.
+        """
+        key = self._entry_key(result.file_path)
+        digest = self._digests.pop(key, None)
+        if digest is None:
+            return
+        self.entries[key] = {
+            'hash': digest,
+            'diagrams_found': result.diagrams_found,
+            'diagrams_changed': result.diagrams_changed,
+            'errors': list(result.errors),
+            'warnings': list(result.warnings),
+            'spans': list(result.spans),
+        }
+        self._dirty = True
+
+    def save(self):
+        """Atomically write the cache file if anything changed."""
+        if not self._dirty:
+            return
+        import json
+        import tempfile
+
+        data = json.dumps({'key': self.key, 'files': self.entries})
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix='.results-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        self._dirty = False
+
+
+# =============================================================================
+# Parallel Processing
+# =============================================================================
+
+# Each worker process owns a single MarkdownProcessor, created by the pool
+# initializer so parsers are not rebuilt (or pickled) per file.
+_worker_processor: Optional[MarkdownProcessor] = None
+
+
+def _init_worker(processor_options: dict):
+    """Pool initializer: create this worker's MarkdownProcessor."""
+    global _worker_processor
+    _worker_processor = MarkdownProcessor(**processor_options)
+
+
+def _process_batch_in_worker(file_paths: List[Path]) -> List[FileResult]:
+    """Process a batch of files using the worker's MarkdownProcessor."""
+    return [_worker_processor.process_file(file_path) for file_path in file_paths]
+
+
+def _batches(files: List[Path], size: int, max_bytes: int) -> Iterator[List[Path]]:
+    """Split files into batches of at most size files and about max_bytes."""
+    batch: List[Path] = []
+    batch_bytes = 0
+    for file_path in files:
+        try:
+            batch_bytes += file_path.stat().st_size
+        except OSError:
+            pass  # process_file reports it
+        batch.append(file_path)
+        if len(batch) >= size or batch_bytes >= max_bytes:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+
+def _process_files(files: List[Path], jobs: int,
+                   processor_options: dict) -> Iterator[FileResult]:
+    """Run process_file over files, in a process pool if jobs > 1."""
+    if jobs <= 1 or len(files) < 2:
+        processor = MarkdownProcessor(**processor_options)
+        for file_path in files:
+            yield processor.process_file(file_path)
+        return
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = min(jobs, len(files))
+    # Batch small files together to keep inter-process overhead low
+    chunksize = max(1, min(64, len(files) // (workers * 4)))
+    batches = _batches(files, chunksize, POOL_BATCH_BYTES)
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                   initargs=(processor_options,))
+    # Results carry file contents, so only a few batches per worker, each
+    # capped in bytes, are in flight: a consumer slower than the workers
+    # (diffs, a slow terminal) must not let finished batches pile up
+    pending = deque()
+    try:
+        for batch in islice(batches, workers * POOL_BATCHES_AHEAD):
+            pending.append(executor.submit(_process_batch_in_worker, batch))
+        while pending:
+            results = pending.popleft().result()
+            batch = next(batches, None)
+            if batch is not None:
+                pending.append(executor.submit(_process_batch_in_worker, batch))
+            yield from results
+    finally:
+        # Drop queued work if the consumer stops early (--fail-fast)
+        if sys.version_info >= (3, 9):
+            executor.shutdown(cancel_futures=True)
+        else:
+            executor.shutdown()
+
+
+def _read_ahead(file_path: Path, limit: Optional[int]) -> Optional[bytes]:
+    """Read a file for prefetch_files; None leaves reading it to the processor."""
+    try:
+        with open(file_path, 'rb') as f:
+            if limit is not None and os.fstat(f.fileno()).st_size >= limit:
+                return None
+            return f.read()
+    except OSError:
+        return None
+
+
+def prefetch_files(files: Iterable[Path], depth: int,
+                   limit: Optional[int] = None) -> Iterator[Tuple[Path, Optional[bytes]]]:
+    """Yield (file, content bytes) in order, reading up to depth files ahead.
+
+    Reads run on a small thread pool while the caller parses and formats,
+    so I/O latency (e.g. on a network mount) overlaps with CPU work. At most
+    depth files are read or held ahead of the caller. Files of at least
+    limit bytes and files that cannot be read come with None, for the
+    caller to stream or report.
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    remaining = iter(files)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=min(depth, PREFETCH_THREADS)) as pool:
+        def submit(file_path: Path):
+            pending.append((file_path, pool.submit(_read_ahead, file_path, limit)))
+
+        try:
+            for file_path in islice(remaining, depth):
+                submit(file_path)
+            while pending:
+                file_path, future = pending.popleft()
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    submit(next_path)
+                yield file_path, future.result()
+        finally:
+            # The caller stopped early (--fail-fast): drop reads not yet started
+            for _, future in pending:
+                future.cancel()
+
+
+def _process_prefetched(files: Iterable[Path], depth: int, cache: Optional[ResultCache],
+                        allow_changed: bool, processor_options: dict) -> Iterator[FileResult]:
+    """Process files one at a time while prefetch_files reads ahead.
+
+    The prefetched bytes serve both the cache lookup and the processor, so
+    each file is read once. files may be a lazy walk; each file is looked
+    up and processed as it arrives. With depth 0, or a single file, there
+    is no read-ahead.
+    """
+    processor = MarkdownProcessor(**processor_options)
+    files = iter(files)
+    head = list(islice(files, 2))
+    files = chain(head, files)
+    if depth > 0 and len(head) > 1:
+        # Files that will be streamed are left for the processor to read
+        reads = prefetch_files(files, depth, processor.stream_threshold)
+    else:
+        reads = ((file_path, None) for file_path in files)
+    try:
+        while True:
+            # Time spent waiting for a read still in flight counts as reading
+            waited: Dict[str, List[float]] = {}
+            with (PhaseTimer(waited) if processor.profile else NULL_TIMER).phase('read'):
+                item = next(reads, None)
+            if item is None:
+                break
+            file_path, data = item
+            if cache is not None:
+                hit = cache.lookup(file_path, allow_changed, data)
+                if hit is not None:
+                    _add_timings(hit, waited)
+                    yield hit
+                    continue
+            result = processor.process_file(file_path, data)
+            data = None
+            _add_timings(result, waited)
+            if cache is not None:
+                cache.store(result)
+            yield result
+    finally:
+        reads.close()
+
+
+def _add_timings(result: FileResult, times: Dict[str, List[float]]):
+    """Add phase times measured outside the processor to a file's timings."""
+    for name, (wall, cpu) in times.items():
+        total = result.timings.setdefault(name, [0.0, 0.0])
+        total[0] += wall
+        total[1] += cpu
+
+
+def iter_results(files: Iterable[Path], jobs: int = 1, cache: Optional[ResultCache] = None,
+                 allow_changed: bool = False, processor_options: Optional[dict] = None,
+                 prefetch: int = 0) -> Iterator[FileResult]:
+    """Process files and yield their results in the same order as files.
+
+    With jobs > 1 the files are sent to a process pool; results are still
+    yielded in input order so diffs, summaries and exit codes stay
+    deterministic. Files with a valid cache entry are not processed at all.
+    processor_options are passed to each MarkdownProcessor. With a single
+    job, files are consumed lazily (processing starts before a directory
+    walk finishes) and prefetch > 0 reads that many files ahead on a thread
+    pool (see prefetch_files); worker processes already read in parallel.
+    """
+    processor_options = processor_options or {}
+    if jobs <= 1:
+        yield from _process_prefetched(files, prefetch, cache, allow_changed, processor_options)
+        return
+
+    files = list(files)
+    if cache is None:
+        yield from _process_files(files, jobs, processor_options)
+        return
+
+    cached = [cache.lookup(file_path, allow_changed) for file_path in files]
+    misses = _process_files([f for f, hit in zip(files, cached) if hit is None], jobs,
+                            processor_options)
+    for hit in cached:
+        if hit is not None:
+            yield hit
+        else:
+            result = next(misses)
+            cache.store(result)
+            yield result
+
+
+# =============================================================================
+# Watch Mode
+# =============================================================================
+
+class _Inotify:
+    """Minimal ctypes binding for Linux inotify, used by FileWatcher.
+
+    Raises OSError (or AttributeError without inotify support in libc) if
+    inotify is unavailable, in which case the watcher falls back to polling.
+    ignored(path) is True for directories that are not to be watched.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_ISDIR = 0x40000000
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, ignored: Optional[Callable[[Path], bool]] = None):
+        import ctypes
+        import struct
+
+        self._ignored = ignored
+        self._ctypes = ctypes
+        self._header = struct.Struct('iIII')  # wd, mask, cookie, name length
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs: Dict[int, Path] = {}
+
+    def watch(self, directory: Path, recursive: bool = True):
+        """Watch directory and, if recursive, every non-hidden, unpruned directory below it."""
+        for dirpath, dirnames, _ in os.walk(directory):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.') and d not in PRUNED_DIRS
+                           and not (self._ignored and self._ignored(Path(dirpath, d)))]
+            wd = self._add_watch(self.fd, os.fsencode(dirpath), self.WATCH_MASK)
+            if wd < 0:
+                raise OSError(self._ctypes.get_errno(), f'cannot watch {dirpath}')
+            self._dirs[wd] = Path(dirpath)
+            if not recursive:
+                break
+
+    def read(self, timeout: Optional[float]) -> List[Path]:
+        """Wait up to timeout seconds and return the paths of changed entries."""
+        import select
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        paths = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self._header.unpack_from(data, offset)
+            offset += self._header.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = directory / os.fsdecode(name)
+            if mask & self.IN_ISDIR:
+                if (mask & (self.IN_CREATE | self.IN_MOVED_TO) and not path.name.startswith('.')
+                        and path.name not in PRUNED_DIRS
+                        and not (self._ignored and self._ignored(path))):
+                    self.watch(path)
+                continue
+            paths.append(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileWatcher:
+    """Detects saved Markdown files using an (mtime, size) index.
+
+    Change notifications come from inotify when available and from polling
+    otherwise; either way a file is only reported once its signature differs
+    from the index and has stayed stable for the debounce period, so editors
+    that save in several steps trigger a single run. Call mark_written after
+    rewriting a file so the watcher does not react to its own writes.
+
+    Directories and files that a walk of the paths skips (see
+    iter_markdown_files) are neither watched nor reported.
+    """
+
+    # Polling mode rescans the paths for new files this often (seconds)
+    RESCAN_INTERVAL = 2.0
+
+    def __init__(self, paths: List[str], interval: float = DEFAULT_WATCH_INTERVAL,
+                 debounce: float = WATCH_DEBOUNCE, use_inotify: bool = True,
+                 exclude: Optional[List[str]] = None):
+        self.paths = paths
+        self.exclude = exclude
+        self.interval = interval
+        self.debounce = debounce
+        self.index: Dict[Path, Tuple[int, int]] = {}
+        self._pending: Dict[Path, Tuple[Tuple[int, int], float]] = {}
+        self._file_args = set()
+        self._dir_args = []
+        for path_str in paths:
+            path = Path(path_str)
+            if path.is_dir():
+                self._dir_args.append(path)
+            else:
+                self._file_args.add(path)
+        self._walk_rules = {directory: _walk_rules(directory, exclude or [])
+                            for directory in self._dir_args}
+
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = _Inotify(lambda path: not self._walked(path, True))
+                for directory in self._dir_args:
+                    self._inotify.watch(directory)
+                for directory in {p.parent for p in self._file_args}:
+                    self._inotify.watch(directory, recursive=False)
+            except (OSError, AttributeError):
+                if self._inotify is not None:
+                    self._inotify.close()
+                self._inotify = None
+
+        for file_path in iter_markdown_files(paths, exclude):
+            signature = self._signature(file_path)
+            if signature:
+                self.index[file_path] = signature
+
+    @property
+    def backend(self) -> str:
+        return 'inotify' if self._inotify else 'polling'
+
+    @staticmethod
+    def _signature(file_path: Path) -> Optional[Tuple[int, int]]:
+        try:
+            st = file_path.stat()
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def _is_watched(self, path: Path) -> bool:
+        if path in self._file_args or path in self.index:
+            return True
+        if path.suffix.lower() not in MARKDOWN_SUFFIXES or path.name.startswith('.'):
+            return False
+        return self._walked(path, False)
+
+    def _walked(self, path: Path, is_dir: bool) -> bool:
+        """Whether walking the directory arguments reaches path.
+
+        Applies the rules the walk would, including any .gitignore files
+        between the directory argument and path.
+        """
+        for directory in self._dir_args:
+            if directory not in path.parents:
+                continue
+            rel, rules = self._walk_rules[directory]
+            parts = path.relative_to(directory).parts
+            current = directory
+            for depth, name in enumerate(parts):
+                ignore = current / '.gitignore'
+                if ignore.is_file():
+                    rules = IgnoreRules(_read_lines(str(ignore)), rel, rules)
+                rel = f'{rel}/{name}' if rel else name
+                entry_is_dir = is_dir or depth < len(parts) - 1
+                if entry_is_dir and name in PRUNED_DIRS:
+                    break
+                if rules and rules.ignores(rel, name, entry_is_dir):
+                    break
+                current = current / name
+            else:
+                return True
+        return False
+
+    def mark_written(self, file_path: Path):
+        """Record a file we just wrote so the write is not reported."""
+        signature = self._signature(file_path)
+        if signature:
+            self.index[file_path] = signature
+        self._pending.pop(file_path, None)
+
+    def _candidates(self, last_rescan: float) -> Tuple[List[Path], float]:
+        """Wait for the next batch of possibly changed paths."""
+        timeout = self.debounce if self._pending else self.interval
+        if self._inotify:
+            return self._inotify.read(timeout if self._pending else None), last_rescan
+
+        time.sleep(timeout)
+        candidates = list(self.index)
+        if time.monotonic() - last_rescan >= self.RESCAN_INTERVAL:
+            candidates.extend(p for p in iter_markdown_files(self.paths, self.exclude)
+                              if p not in self.index)
+            last_rescan = time.monotonic()
+        return candidates, last_rescan
+
+    def changes(self) -> Iterator[Path]:
+        """Yield each Markdown file once its changes have settled. Runs forever."""
+        last_rescan = time.monotonic()
+        while True:
+            candidates, last_rescan = self._candidates(last_rescan)
+            now = time.monotonic()
+
+            for path in candidates:
+                if not self._is_watched(path):
+                    continue
+                signature = self._signature(path)
+                if signature is None:
+                    # Deleted (or replaced mid-save; the rename is seen later)
+                    self.index.pop(path, None)
+                    self._pending.pop(path, None)
+                elif signature != self.index.get(path):
+                    pending = self._pending.get(path)
+                    if pending is None or pending[0] != signature:
+                        self._pending[path] = (signature, now)
+
+            for path, (signature, changed_at) in list(self._pending.items()):
+                if now - changed_at < self.debounce:
+                    continue
+                current = self._signature(path)
+                if current != signature:
+                    # Still being written; wait for it to settle
+                    if current is None:
+                        del self._pending[path]
+                    else:
+                        self._pending[path] = (current, now)
+                    continue
+                del self._pending[path]
+                if current != self.index.get(path):
+                    self.index[path] = current
+                    yield path
+
+    def close(self):
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+
+# =============================================================================
+# Editor Server
+# =============================================================================
+
+class FormatServer:
+    """JSON-RPC 2.0 server for editor integrations, spoken over stdio.
+
+    Each message is one JSON object per line. A single long-lived
+    MarkdownProcessor serves every request, so editors pay for interpreter
+    startup and pattern compilation once rather than on every save.
+
+    Methods (positions are LSP-style, 0-based lines):
+        formatDocument {text, uri?}        -> {edits: [{range, newText}]}
+        formatRange    {text, range, uri?} -> edits for diagrams touching range
+        validate       {text, uri?}        -> {diagnostics: [{range, severity, message}]}
+        shutdown                           -> null, then the server exits
+    """
+
+    PARSE_ERROR = -32700
+    INVALID_REQUEST = -32600
+    METHOD_NOT_FOUND = -32601
+    INVALID_PARAMS = -32602
+    INTERNAL_ERROR = -32603
+
+    # LSP diagnostic severities
+    SEVERITY_ERROR = 1
+    SEVERITY_WARNING = 2
+
+    def __init__(self, processor: Optional[MarkdownProcessor] = None):
+        self.processor = processor or MarkdownProcessor()
+        self.running = True
+        self._methods = {
+            'formatDocument': self._format_document,
+            'formatRange': self._format_range,
+            'validate': self._validate,
+            'shutdown': self._shutdown,
+        }
+
+    def serve(self, stdin=None, stdout=None):
+        """Answer requests from stdin until shutdown or end of input."""
+        import json
+
+        stdin = stdin or sys.stdin
+        stdout = stdout or sys.stdout
+        for line in stdin:
+            if not line.strip():
+                continue
+            response = self.handle_message(line)
+            if response is not None:
+                stdout.write(json.dumps(response) + '\n')
+                stdout.flush()
+            if not self.running:
+                break
+
+    def handle_message(self, line: str) -> Optional[dict]:
+        """Handle one JSON-RPC message and return the response (None for notifications)."""
+        import json
+
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return self._error(None, self.PARSE_ERROR, f"Parse error: {e}")
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return self._error(None, self.INVALID_REQUEST, "Invalid request")
+
+        request_id = request.get('id')
+        method = self._methods.get(request['method'])
+        if method is None:
+            response = self._error(request_id, self.METHOD_NOT_FOUND,
+                                   f"Method not found: {request['method']}")
+        else:
+            params = request.get('params') or {}
+            try:
+                response = {'jsonrpc': '2.0', 'id': request_id, 'result': method(params)}
+            except (KeyError, TypeError, ValueError) as e:
+                response = self._error(request_id, self.INVALID_PARAMS, f"Invalid params: {e}")
+            except Exception as e:
+                response = self._error(request_id, self.INTERNAL_ERROR, str(e))
+
+        return response if 'id' in request else None
+
+    @staticmethod
+    def _error(request_id, code: int, message: str) -> dict:
+        return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+    @staticmethod
+    def _range(start_line: int, end_line: int) -> dict:
+        return {
+            'start': {'line': start_line, 'character': 0},
+            'end': {'line': end_line, 'character': 0},
+        }
+
+    def _blocks(self, params: dict):
+        """Yield (block, body_start, body_end, formatted_body, changed, error) tuples.
+
+        body_start and body_end are the line range of the block body in
+        params['text']; formatted_body is None if the diagram failed to format.
+        """
+        text = params['text']
+        if not isinstance(text, str):
+            raise TypeError("'text' must be a string")
+        file_path = Path(params.get('uri') or '<buffer>')
+
+        # Work on LF text; line numbers are the same for CRLF buffers
+        for block in self.processor.find_mermaid_blocks(text.replace('\r\n', '\n')):
+            body_start = block.start_line + 1
+            body_end = body_start + block.body.count('\n')
+            try:
+                formatted_body, changed = self.processor.format_block(block, file_path)
+            except Exception as e:
+                yield block, body_start, body_end, None, False, str(e)
+                continue
+            yield block, body_start, body_end, formatted_body, changed, None
+
+    def _edits(self, params: dict, first_line: int = 0, last_line: Optional[int] = None) -> dict:
+        newline = '\r\n' if '\r\n' in params['text'] else '\n'
+        edits = []
+        for block, body_start, body_end, formatted_body, _, error in self._blocks(params):
+            if error or formatted_body == block.body:
+                continue
+            # Only diagrams that overlap the requested lines (fences included)
+            if body_end < first_line or (last_line is not None and block.start_line > last_line):
+                continue
+            edits.append({
+                'range': self._range(body_start, body_end),
+                'newText': formatted_body.replace('\n', newline),
+            })
+        return {'edits': edits}
+
+    def _format_document(self, params: dict) -> dict:
+        return self._edits(params)
+
+    def _format_range(self, params: dict) -> dict:
+        line_range = params['range']
+        return self._edits(params, int(line_range['start']['line']),
+                           int(line_range['end']['line']))
+
+    def _validate(self, params: dict) -> dict:
+        diagnostics = []
+        for block, _, body_end, _, changed, error in self._blocks(params):
+            if error:
+                severity, message = self.SEVERITY_ERROR, f"Failed to format diagram: {error}"
+            elif changed:
+                severity = self.SEVERITY_WARNING
+                message = "Diagram does not conform to the Mermaid style guide"
+            else:
+                continue
+            diagnostics.append({
+                'range': self._range(block.start_line, body_end + 1),
+                'severity': severity,
+                'source': 'format-mermaid',
+                'message': message,
+            })
+        return {'diagnostics': diagnostics}
+
+    def _shutdown(self, params: dict) -> None:
+        self.running = False
+        return None
+
+
+# =============================================================================
+# CLI and Main
+# =============================================================================
+
+def parse_jobs(value: str) -> int:
+    """Parse the --jobs argument: a positive integer or 'auto'."""
+    import argparse
+
+    if value.lower() == 'auto':
+        return os.cpu_count() or 1
+    try:
+        jobs = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a positive integer or 'auto', got {value!r}")
+    if jobs < 1:
+        raise argparse.ArgumentTypeError(f"expected a positive integer or 'auto', got {value!r}")
+    return jobs
+
+
+class IgnoreRules:
+    """Glob patterns for paths a directory walk skips, in .gitignore style.
+
+    A pattern without a slash matches a name at any depth below base; one
+    with a leading or inner slash matches the path relative to base. A
+    trailing slash (or dirs_only) limits a pattern to directories. Negated
+    (!) patterns are not supported and are ignored. Rules chain to the
+    rules of enclosing directories through parent.
+    """
+
+    __slots__ = ('parent', 'base', 'dirs_only', '_names', '_dir_names', '_paths', '_dir_paths')
+
+    def __init__(self, patterns: Iterable[str], base: str = '',
+                 parent: Optional['IgnoreRules'] = None, dirs_only: bool = False):
+        self.parent = parent
+        self.base = base
+        self.dirs_only = dirs_only
+        groups = ([], [], [], [])
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith(('#', '!')):
+                continue
+            dir_only = dirs_only or pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            anchored = '/' in pattern
+            if pattern:
+                groups[2 * anchored + dir_only].append(self.translate(pattern.lstrip('/')))
+        self._names, self._dir_names, self._paths, self._dir_paths = (
+            re.compile('|'.join(group)).match if group else None for group in groups
+        )
+
+    @staticmethod
+    def translate(pattern: str) -> str:
+        """Translate a .gitignore glob into a regular expression.
+
+        Unlike fnmatch.translate, * and ? (and bracket expressions) never
+        match a slash: only ** spans directories, as a leading **/ (any
+        leading directories), an inner /**/ (zero or more directories) or a
+        trailing /** (everything inside).
+        """
+        parts = []
+        i, n = 0, len(pattern)
+        while i < n:
+            c = pattern[i]
+            if c == '*':
+                if (pattern.startswith('**', i) and (i == 0 or pattern[i - 1] == '/')
+                        and (i + 2 == n or pattern[i + 2] == '/')):
+                    parts.append('.*' if i + 2 == n else '(?:.*/)?')
+                    i += 3
+                    continue
+                while i < n and pattern[i] == '*':
+                    i += 1
+                parts.append('[^/]*')
+                continue
+            if c == '?':
+                parts.append('[^/]')
+            elif c == '[':
+                j = i + 1
+                if j < n and pattern[j] in '!^':
+                    j += 1
+                if j < n and pattern[j] == ']':
+                    j += 1
+                j = pattern.find(']', j)
+                if j < 0:
+                    parts.append(re.escape(c))
+                else:
+                    body = pattern[i + 1:j]
+                    negated = body[:1] in ('!', '^')
+                    body = ''.join(ch if ch == '-' else re.escape(ch)
+                                   for ch in body[negated:])
+                    parts.append(f'[^/{body}]' if negated else f'(?!/)[{body}]')
+                    i = j
+            elif c == '\\' and i + 1 < n:
+                i += 1
+                parts.append(re.escape(pattern[i]))
+            else:
+                parts.append(re.escape(c))
+            i += 1
+        return f"(?s:{''.join(parts)})\\Z"
+
+    def ignores(self, rel: str, name: str, is_dir: bool) -> bool:
+        """Whether the entry name at rel (relative to the walk's top) is ignored."""
+        rules = self
+        while rules is not None:
+            if rules._names and rules._names(name):
+                return True
+            if is_dir and rules._dir_names and rules._dir_names(name):
+                return True
+            if rules._paths or rules._dir_paths:
+                base = rules.base
+                if not base:
+                    path = rel
+                elif rel.startswith(base + '/'):
+                    path = rel[len(base) + 1:]
+                else:
+                    path = None
+                if path is not None:
+                    if rules._paths and rules._paths(path):
+                        return True
+                    if is_dir and rules._dir_paths and rules._dir_paths(path):
+                        return True
+            rules = rules.parent
+        return False
+
+
+def _read_lines(path: str) -> List[str]:
+    try:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return f.read().splitlines()
+    except OSError:
+        return []
+
+
+def jekyll_excludes(config_path: str) -> List[str]:
+    """The exclude: list of a Jekyll _config.yml.
+
+    Reads the block (- item) and flow ([a, b]) list forms with a small line
+    parser, so no YAML library is needed.
+    """
+    def scalar(text: str) -> str:
+        text = text.split(' #', 1)[0].strip()
+        if len(text) > 1 and text[0] == text[-1] and text[0] in '"\'':
+            text = text[1:-1]
+        return text
+
+    excludes = []
+    in_list = False
+    for line in _read_lines(config_path):
+        stripped = line.strip()
+        if in_list:
+            if stripped.startswith('-'):
+                excludes.append(scalar(stripped[1:]))
+                continue
+            if not stripped or stripped.startswith('#'):
+                continue
+            break
+        if line.startswith('exclude:'):
+            value = line[len('exclude:'):].split(' #', 1)[0].strip()
+            if value.startswith('['):
+                excludes.extend(scalar(item) for item in value.strip('[]').split(','))
+                break
+            in_list = True
+    return [item for item in excludes if item]
+
+
+def _walk_rules(directory: Path, exclude: List[str]) -> Tuple[str, Optional[IgnoreRules]]:
+    """The walk's top and the rules in force at directory before its own .gitignore.
+
+    The top is the enclosing git work tree (or directory itself). Rules come
+    from .gitignore files between the top and directory, the exclude: list
+    of the nearest _config.yml up to directory (directories only: Jekyll
+    excludes files such as README.md from the site, but their diagrams
+    still render on GitHub), and the --exclude patterns. Returns
+    directory's path relative to the top with the rules.
+    """
+    directory = directory.resolve()
+    ancestors = [directory]
+    for parent in directory.parents:
+        if (ancestors[-1] / '.git').exists():
+            break
+        ancestors.append(parent)
+    else:
+        ancestors = [directory]
+    ancestors.reverse()
+    top = ancestors[0]
+
+    rules = None
+    for ancestor in ancestors[:-1]:
+        ignore = ancestor / '.gitignore'
+        if ignore.is_file():
+            rules = IgnoreRules(_read_lines(str(ignore)), _relative(ancestor, top), rules)
+    for ancestor in reversed(ancestors):
+        config = ancestor / '_config.yml'
+        if config.is_file():
+            rules = IgnoreRules(jekyll_excludes(str(config)), _relative(ancestor, top), rules,
+                                dirs_only=True)
+            break
+    rel = _relative(directory, top)
+    if exclude:
+        rules = IgnoreRules(exclude, rel, rules)
+    return rel, rules
+
+
+def _relative(path: Path, top: Path) -> str:
+    rel = path.relative_to(top).as_posix()
+    return '' if rel == '.' else rel
+
+
+def _walk_markdown(directory: str, rel: str, rules: Optional[IgnoreRules]) -> Iterator[Path]:
+    """Yield the Markdown files below directory, depth first in sorted order.
+
+    Entries are sorted by name and directories are entered where they sort,
+    which yields files in the same order as sorting all their paths.
+    Symlinked directories are not followed.
+    """
+    try:
+        with os.scandir(directory) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return
+
+    for entry in entries:
+        if entry.name == '.gitignore' and entry.is_file():
+            rules = IgnoreRules(_read_lines(entry.path), rel, rules)
+            break
+
+    for entry in entries:
+        name = entry.name
+        entry_rel = f'{rel}/{name}' if rel else name
+        try:
+            is_dir = entry.is_dir(follow_symlinks=False)
+        except OSError:
+            continue
+        if is_dir:
+            if name in PRUNED_DIRS or (rules and rules.ignores(entry_rel, name, True)):
+                continue
+            yield from _walk_markdown(entry.path, entry_rel, rules)
+        elif (name.lower().endswith(MARKDOWN_SUFFIXES) and entry.is_file()
+                and not (rules and rules.ignores(entry_rel, name, False))):
+            yield Path(entry.path)
+
+
+def iter_markdown_files(paths: List[str], exclude: Optional[List[str]] = None) -> Iterator[Path]:
+    """Yield the Markdown files in the given paths as they are found.
+
+    Directories are walked once with os.scandir, skipping PRUNED_DIRS and
+    whatever .gitignore, _config.yml (exclude:) and the exclude patterns
+    rule out (see IgnoreRules); the pruned trees are never read. Files
+    named explicitly are always included. Each directory's files come in
+    sorted order, paths in the order given, and each file once.
+    """
+    seen = set()
+    for path_str in paths:
+        path = Path(path_str)
+        if path.is_file():
+            files = [path] if path.suffix.lower() in MARKDOWN_SUFFIXES else []
+        elif path.is_dir():
+            rel, rules = _walk_rules(path, exclude or [])
+            files = _walk_markdown(str(path), rel, rules)
+        else:
+            continue
+        for file_path in files:
+            if file_path not in seen:
+                seen.add(file_path)
+                yield file_path
+
+
+def find_markdown_files(paths: List[str], exclude: Optional[List[str]] = None) -> List[Path]:
+    """Find all Markdown files in the given paths (see iter_markdown_files)."""
+    return list(iter_markdown_files(paths, exclude))
+
+
+def _git(*args: str) -> str:
+    """Run a git command and return its stdout, raising RuntimeError on failure."""
+    import subprocess
+
+    try:
+        proc = subprocess.run(
+            ['git', *args],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=False
+        )
+    except OSError as e:
+        raise RuntimeError(f"could not run git: {e}")
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip() or f"git {args[0]} failed")
+    return proc.stdout
+
+
+def find_changed_markdown_files(paths: List[str], since: Optional[str] = None,
+                                staged: bool = False) -> List[Path]:
+    """Find Markdown files under paths that git reports as changed.
+
+    since: compare against the merge base of this ref and HEAD, so a PR
+           branch only sees its own changes (committed or not).
+    staged: compare the index instead of the working tree.
+
+    Renamed files are reported under their new name; deleted files are
+    skipped. Raises RuntimeError if git fails (e.g. unknown ref).
+    """
+    top = Path(_git('rev-parse', '--show-toplevel').strip())
+
+    diff_args = ['diff', '--name-only', '-z', '-M', '--diff-filter=d']
+    if staged:
+        diff_args.append('--cached')
+    if since:
+        diff_args.append(_git('merge-base', since, 'HEAD').strip())
+    names = _git(*diff_args, '--', *paths).split('\0')
+
+    if since and not staged:
+        # New files a writer has not added yet are changes too
+        untracked = _git('ls-files', '--others', '--exclude-standard', '--full-name',
+                         '-z', '--', *paths)
+        names.extend(untracked.split('\0'))
+
+    files = set()
+    for name in names:
+        if not name or Path(name).suffix.lower() not in ['.md', '.markdown']:
+            continue
+        path = Path(os.path.relpath(top / name))
+        if path.is_file():
+            files.add(path)
+    return sorted(files)
+
+
+def generate_diff(original: str, formatted: str, filename: str,
+                  edits: Optional[List[Tuple[int, int, int, int, int]]] = None,
+                  context: int = 3) -> str:
+    """Generate a unified diff between original and formatted content.
+
+    With edits (see FileResult.edits) only the rewritten diagram bodies and
+    context lines around them are compared: nearby edits are grouped, each
+    group is diffed on its own and its hunks are numbered with the file's
+    line numbers. Diff time grows with the changed diagrams, not the file.
+    Without edits the whole documents are compared. The result is a patch
+    that git apply accepts.
+    """
+    from difflib import SequenceMatcher
+
+    if edits is None:
+        edits = [(0, len(original), 0, len(formatted), 0)]
+
+    # [start, end, new start, new end, first line, new first line] of each
+    # region to compare, widened by context lines on both sides
+    regions = []
+    line_delta = 0
+    for start, end, new_start, new_end, line in edits:
+        lo, before = start, 0
+        while before < context and lo > 0:
+            lo = original.rfind('\n', 0, lo - 1) + 1
+            before += 1
+        hi = end
+        for _ in range(context):
+            if hi >= len(original):
+                break
+            newline = original.find('\n', hi)
+            hi = len(original) if newline < 0 else newline + 1
+
+        if regions and lo <= regions[-1][1]:
+            regions[-1][1] = hi
+            regions[-1][3] = hi + new_end - end
+        else:
+            first = line - before
+            regions.append([lo, hi, lo + new_start - start, hi + new_end - end,
+                            first, first + line_delta])
+        line_delta += formatted.count('\n', new_start, new_end) - original.count('\n', start, end)
+
+    diff = []
+    for lo, hi, new_lo, new_hi, first, new_first in regions:
+        a = list(iter_lines(original[lo:hi]))
+        b = list(iter_lines(formatted[new_lo:new_hi]))
+        for group in SequenceMatcher(None, a, b).get_grouped_opcodes(context):
+            i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
+            diff.append(f"@@ -{_unified_range(first + i1, i2 - i1)} "
+                        f"+{_unified_range(new_first + j1, j2 - j1)} @@\n")
+            for tag, i1, i2, j1, j2 in group:
+                if tag == 'equal':
+                    _add_diff_lines(diff, ' ', a[i1:i2])
+                    continue
+                _add_diff_lines(diff, '-', a[i1:i2])
+                _add_diff_lines(diff, '+', b[j1:j2])
+
+    if not diff:
+        return ''
+    return f"--- a/{filename}\n+++ b/{filename}\n" + ''.join(diff)
+
+
+def _unified_range(start: int, length: int) -> str:
+    """A hunk range for 0-based start, as difflib.unified_diff writes it."""
+    if length == 1:
+        return str(start + 1)
+    return f"{start + 1 if length else start},{length}"
+
+
+def _add_diff_lines(diff: List[str], prefix: str, lines: List[str]):
+    for line in lines:
+        diff.append(prefix + line)
+        if not line.endswith('\n'):
+            diff.append('\n\\ No newline at end of file\n')
+
+
+def write_result(result: FileResult, writer: Optional[FileWriter] = None) -> bool:
+    """Write a result's formatted content back to its file if it changed.
+
+    Returns True if the file was (or had already been) rewritten; files
+    whose content on disk already matches are not touched. Write failures
+    are recorded in result.errors.
+    """
+    if result.written:
+        return True
+    if result.diagrams_changed == 0 or result.errors or result.streamed:
+        return False
+    try:
+        written = (writer or FileWriter()).write(result.file_path, result.formatted_content)
+    except Exception as e:
+        result.errors.append(f"Failed to write file: {e}")
+        return False
+    result.written = written
+    return written
+
+
+def run_watch(args, write: bool) -> int:
+    """Watch the given paths and process each Markdown file when it is saved."""
+    processor = MarkdownProcessor(memo_size=args.memo_size, lint=args.lint)
+    watcher = FileWatcher(args.paths, interval=args.watch_interval, use_inotify=not args.poll,
+                          exclude=args.exclude)
+    print(f"Watching {len(watcher.index)} Markdown file(s) using {watcher.backend} "
+          f"(Ctrl-C to stop)")
+
+    try:
+        for file_path in watcher.changes():
+            started = time.perf_counter()
+            result = processor.process_file(file_path)
+
+            if args.diff and result.diagrams_changed > 0:
+                diff = generate_diff(
+                    result.original_content,
+                    result.formatted_content,
+                    str(result.file_path),
+                    result.edits
+                )
+                if diff:
+                    print(diff)
+
+            if write and write_result(result):
+                watcher.mark_written(file_path)
+                status = "reformatted"
+            elif result.diagrams_changed:
+                status = "needs formatting"
+            else:
+                status = "ok"
+            result.release_content()
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            if result.diagrams_found or result.errors or args.verbose:
+                print(f"{file_path}: {result.diagrams_found} diagram(s), {status} "
+                      f"({elapsed_ms:.0f} ms)")
+            for error in result.errors:
+                print(f"  ERROR: {error}")
+            for warning in result.warnings:
+                print(f"  WARNING: {warning}")
+    except KeyboardInterrupt:
+        print("\nStopped watching.")
+    finally:
+        watcher.close()
+    return 0
+
+
+class RunSummary:
+    """Running totals for the end-of-run summary.
+
+    Results are folded in as they arrive, so a run does not have to keep
+    every FileResult (and its file content) until the end.
+    """
+
+    def __init__(self, keep_details: bool = False):
+        self.files = 0
+        self.files_with_diagrams = 0
+        self.files_changed = 0
+        self.diagrams = 0
+        self.diagrams_changed = 0
+        self.errors = 0
+        self.warnings = 0
+        self.memo_hits = 0
+        self.memo_misses = 0
+        # (path, diagrams, status, errors) per file with diagrams, for -v
+        self.details: Optional[List[Tuple[Path, int, str, List[str]]]] = (
+            [] if keep_details else None
+        )
+
+    def add(self, result: FileResult):
+        self.files += 1
+        self.files_with_diagrams += result.diagrams_found > 0
+        self.files_changed += result.diagrams_changed > 0
+        self.diagrams += result.diagrams_found
+        self.diagrams_changed += result.diagrams_changed
+        self.errors += len(result.errors)
+        self.warnings += len(result.warnings)
+        self.memo_hits += result.memo_hits
+        self.memo_misses += result.memo_misses
+        if self.details is not None and result.diagrams_found > 0:
+            status = "changed" if result.diagrams_changed else "ok"
+            if result.cached:
+                status += " (cached)"
+            self.details.append(
+                (result.file_path, result.diagrams_found, status, result.errors)
+            )
+
+
+def print_summary(summary: RunSummary, mode: str, verbose: bool):
+    """Print summary of formatting operation."""
+    print(f"\n{'=' * 60}")
+    print(f"Mermaid Formatting Summary ({mode})")
+    print(f"{'=' * 60}")
+    print(f"Files scanned:        {summary.files}")
+    print(f"Files with diagrams:  {summary.files_with_diagrams}")
+    print(f"Files with changes:   {summary.files_changed}")
+    print(f"Diagrams found:       {summary.diagrams}")
+    print(f"Diagrams reformatted: {summary.diagrams_changed}")
+
+    if summary.errors:
+        print(f"Errors:               {summary.errors}")
+    if summary.warnings:
+        print(f"Lint warnings:        {summary.warnings}")
+
+    if verbose:
+        print(f"Diagram memo:         {summary.memo_hits} hit(s), "
+              f"{summary.memo_misses} miss(es)")
+        print(f"\n{'=' * 60}")
+        print("Details by file:")
+        print(f"{'=' * 60}")
+        for file_path, diagrams, status, errors in summary.details or []:
+            print(f"  {file_path}: {diagrams} diagram(s), {status}")
+            for error in errors:
+                print(f"    ERROR: {error}")
+
+
+class ReportWriter:
+    """Streams machine-readable results for --report.
+
+    'ndjson' writes one JSON object per line: a "file" record per file and
+    a final "summary" record. 'json' writes the same records as a single
+    document, {"files": [...], "summary": {...}}, built up incrementally.
+    Each record is flushed as soon as its file is done, so CI can ingest
+    the report while the run is still going.
+    """
+
+    FORMATS = ('json', 'ndjson')
+
+    def __init__(self, fmt: str, stream=None):
+        import json
+
+        self._dumps = json.dumps
+        self.format = fmt
+        self.stream = stream or sys.stdout
+        self._count = 0
+        if fmt == 'json':
+            self.stream.write('{"files": [')
+
+    def _emit(self, record: dict):
+        if self.format == 'ndjson':
+            self.stream.write(self._dumps(record) + '\n')
+        else:
+            separator = ',\n' if self._count else '\n'
+            self.stream.write(separator + self._dumps(record))
+        self._count += 1
+        self.stream.flush()
+
+    def file(self, result: FileResult):
+        """Write the record for one processed file."""
+        record = {
+            'type': 'file',
+            'path': str(result.file_path),
+            'diagrams_found': result.diagrams_found,
+            'diagrams_changed': result.diagrams_changed,
+            'written': result.written,
+            'cached': result.cached,
+            'errors': result.errors,
+            'warnings': result.warnings,
+            'diagrams': [
+                {'start_line': start, 'end_line': end, 'changed': changed}
+                for start, end, changed in result.spans
+            ],
+            'elapsed_ms': round(result.elapsed * 1000, 3),
+        }
+        if result.timings:
+            record['timings'] = {
+                name: {'wall_ms': round(wall * 1000, 3), 'cpu_ms': round(cpu * 1000, 3)}
+                for name, (wall, cpu) in result.timings.items()
+            }
+        self._emit(record)
+
+    def finish(self, summary: RunSummary, mode: str, exit_code: int, elapsed: float):
+        """Write the summary record and close the document."""
+        record = {
+            'type': 'summary',
+            'mode': mode,
+            'files_scanned': summary.files,
+            'files_with_diagrams': summary.files_with_diagrams,
+            'files_changed': summary.files_changed,
+            'diagrams_found': summary.diagrams,
+            'diagrams_changed': summary.diagrams_changed,
+            'errors': summary.errors,
+            'warnings': summary.warnings,
+            'elapsed_ms': round(elapsed * 1000, 3),
+            'exit_code': exit_code,
+        }
+        if self.format == 'ndjson':
+            self._emit(record)
+        else:
+            self.stream.write(f'\n], "summary": {self._dumps(record)}}}\n')
+            self.stream.flush()
+
+
+def _timed(iterable: Iterable, timer: PhaseTimer, name: str) -> Iterator:
+    """Yield from iterable, charging the time spent producing items to phase name."""
+    iterator = iter(iterable)
+    while True:
+        with timer.phase(name):
+            item = next(iterator, _timed)
+        if item is _timed:
+            return
+        yield item
+
+
+def run_batch(args, parser, write: bool, report: Optional[ReportWriter] = None) -> int:
+    """Process every Markdown file under args.paths once and return the exit code."""
+    started = time.perf_counter()
+    profile = ProfileReport(args.profile_top) if args.profile else None
+    timer = profile.timer if profile else NULL_TIMER
+    if args.profile_out:
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
+    # Determine mode for summary
+    if args.validate:
+        mode = "validate"
+    elif args.dry_run:
+        mode = "dry-run"
+    else:
+        mode = "format"
+    summary = RunSummary(keep_details=args.verbose)
+
+    # Find files. A directory walk is lazy: files are processed as the walk
+    # finds them, and its time is charged to discovery as it runs.
+    with timer.phase('discovery'):
+        if args.changed_since or args.staged:
+            try:
+                files = find_changed_markdown_files(args.paths, args.changed_since, args.staged)
+            except RuntimeError as e:
+                parser.error(str(e))
+            if args.verbose and files:
+                print(f"Found {len(files)} Markdown file(s) to process")
+            files = iter(files)
+        else:
+            files = iter_markdown_files(args.paths, args.exclude)
+
+        # Files before the first one that could contain a diagram
+        skipped = []
+        for file_path in files:
+            if may_contain_mermaid(file_path):
+                if profile:
+                    # The rest of the walk runs while files are processed
+                    files = _timed(files, timer, 'discovery')
+                files = chain(skipped, [file_path], files)
+                break
+            skipped.append(file_path)
+        else:
+            files = None
+
+    cache = None
+    if files is None:
+        if not skipped:
+            print("No Markdown files found.")
+            if report:
+                report.finish(summary, mode, 0, time.perf_counter() - started)
+            return 0
+        # Fast path: no file can contain a diagram, so skip the cache, the
+        # worker pool and the parser entirely
+        result_iter = (FileResult(f, 0, 0, "", "") for f in skipped)
+    else:
+        # Unchanged files that were conformant last time are skipped entirely
+        cache = None if args.no_cache else ResultCache(Path(args.cache_dir), lint=args.lint)
+
+        # Validation without a diff only needs the cached counts
+        allow_changed = args.validate and not args.diff
+
+        # Large files are streamed (and written in place) unless a diff needs
+        # their full content
+        processor_options = {
+            'stream_threshold': None if args.diff else int(args.stream_threshold * 1024 * 1024),
+            'write_streamed': write,
+            'memo_size': args.memo_size,
+            'profile': args.profile,
+            # Validation without a diff never needs the formatted document
+            'check_only': allow_changed,
+            'fsync': args.fsync,
+            'lint': args.lint,
+        }
+        result_iter = iter_results(files, args.jobs, cache, allow_changed, processor_options,
+                                   args.prefetch)
+
+    # Process files (in parallel if requested; results arrive in file order).
+    # Each result is summarised and reported as it arrives, then dropped.
+    with FileWriter(fsync=args.fsync) as writer:
+        for result in result_iter:
+            file_path = result.file_path
+            if args.verbose:
+                print(f"Processing: {file_path}")
+
+            file_timer = PhaseTimer(result.timings) if profile else NULL_TIMER
+
+            # Show diff if requested
+            if args.diff and result.diagrams_changed > 0:
+                with file_timer.phase('diff'):
+                    diff = generate_diff(
+                        result.original_content,
+                        result.formatted_content,
+                        str(result.file_path),
+                        result.edits
+                    )
+                if diff:
+                    print(diff)
+
+            # Write changes if not dry-run or validate
+            if write:
+                with file_timer.phase('write'):
+                    updated = write_result(result, writer)
+                if updated and args.verbose:
+                    print(f"  Updated: {file_path}")
+            result.release_content()
+
+            for warning in result.warnings:
+                print(f"{file_path}: WARNING: {warning}")
+
+            summary.add(result)
+            if profile:
+                profile.add(result)
+            if report:
+                report.file(result)
+
+            if args.fail_fast and (result.diagrams_changed or result.errors or result.warnings):
+                print(f"Stopping at first non-conforming file (--fail-fast): {file_path}")
+                result_iter.close()
+                break
+
+    for error in writer.errors:
+        print(f"ERROR: {error}")
+        summary.errors += 1
+
+    if cache is not None:
+        try:
+            cache.save()
+        except OSError as e:
+            print(f"Warning: could not write cache: {e}", file=sys.stderr)
+
+    print_summary(summary, mode, args.verbose)
+
+    if args.profile_out:
+        cprofile.disable()
+        cprofile.dump_stats(args.profile_out)
+    if profile:
+        profile.print(time.perf_counter() - started)
+        if args.profile_out:
+            print(f"\ncProfile dump written to {args.profile_out}")
+
+    # Exit code
+    if args.validate:
+        exit_code = 1 if summary.diagrams_changed or summary.errors or summary.warnings else 0
+        if summary.diagrams_changed or summary.errors:
+            print("\nValidation failed: diagrams need formatting or have errors.")
+        elif exit_code:
+            print("\nValidation failed: lint found problems in diagrams.")
+        else:
+            print("\nValidation passed: all diagrams conform to style guide.")
+    else:
+        exit_code = 1 if summary.errors else 0
+
+    if report:
+        report.finish(summary, mode, exit_code, time.perf_counter() - started)
+    return exit_code
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Format Mermaid diagrams according to style guide',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  %(prog)s                     Format all .md files in current directory
+  %(prog)s --dry-run           Preview changes without modifying files
+  %(prog)s --validate          Check conformance (exit 1 if issues)
+  %(prog)s --diff              Show unified diff of changes
+  %(prog)s --validate --jobs auto  Validate using all CPU cores
+  %(prog)s --validate --lint   Also check diagrams for dangling and orphan nodes
+  %(prog)s --watch _portfolio/   Reformat diagrams whenever a file is saved
+  %(prog)s --validate --changed-since origin/main
+                               Validate only files changed on this branch
+  %(prog)s _portfolio/         Format files in specific directory
+"""
+    )
+
+    parser.add_argument(
+        '--version',
+        action='version',
+        version=f'%(prog)s {FORMATTER_VERSION}'
+    )
+
+    parser.add_argument(
+        'paths',
+        nargs='*',
+        default=['.'],
+        help='Files or directories to process (default: current directory)'
+    )
+
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Preview changes without modifying files'
+    )
+
+    parser.add_argument(
+        '--validate',
+        action='store_true',
+        help='Check conformance without modifying; exit 1 if issues found'
+    )
+
+    parser.add_argument(
+        '--diff',
+        action='store_true',
+        help='Show unified diff of changes'
+    )
+
+    parser.add_argument(
+        '--fail-fast',
+        action='store_true',
+        help='With --validate, stop at the first file that needs formatting or has errors'
+    )
+
+    parser.add_argument(
+        '--lint',
+        action='store_true',
+        help='Also check each diagram for edges to undefined nodes, nodes without '
+             'edges and nodes declared in more than one subgraph; with --validate, '
+             'any finding fails the run'
+    )
+
+    parser.add_argument(
+        '--jobs', '-j',
+        type=parse_jobs,
+        default=1,
+        metavar='N',
+        help="Number of worker processes, or 'auto' for one per CPU (default: 1)"
+    )
+
+    parser.add_argument(
+        '--prefetch',
+        type=int,
+        default=DEFAULT_PREFETCH,
+        metavar='N',
+        help='With one job, read up to N files ahead of the parser on a thread pool; '
+             f'0 disables (default: {DEFAULT_PREFETCH})'
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        default=DEFAULT_CACHE_DIR,
+        metavar='DIR',
+        help=f'Directory for the result cache (default: {DEFAULT_CACHE_DIR})'
+    )
+
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Do not read or write the result cache'
+    )
+
+    parser.add_argument(
+        '--memo-size',
+        type=int,
+        default=DEFAULT_MEMO_SIZE,
+        metavar='N',
+        help='Reuse formatting for up to N distinct diagrams seen in this run; '
+             f'0 disables (default: {DEFAULT_MEMO_SIZE})'
+    )
+
+    parser.add_argument(
+        '--stream-threshold',
+        type=float,
+        default=DEFAULT_STREAM_THRESHOLD_MB,
+        metavar='MB',
+        help='Stream files of at least MB megabytes line by line instead of loading '
+             f'them into memory; ignored with --diff (default: {DEFAULT_STREAM_THRESHOLD_MB})'
+    )
+
+    parser.add_argument(
+        '--fsync',
+        action='store_true',
+        help='Make rewritten files durable (fsync) before the run ends; '
+             'the fsyncs are grouped at the end of the run'
+    )
+
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Keep running and process each Markdown file when it is saved'
+    )
+
+    parser.add_argument(
+        '--watch-interval',
+        type=float,
+        default=DEFAULT_WATCH_INTERVAL,
+        metavar='SECONDS',
+        help=f'Polling interval for --watch (default: {DEFAULT_WATCH_INTERVAL})'
+    )
+
+    parser.add_argument(
+        '--poll',
+        action='store_true',
+        help='With --watch, poll for changes even if inotify is available '
+             '(e.g. on network filesystems)'
+    )
+
+    parser.add_argument(
+        '--server',
+        action='store_true',
+        help='Serve formatDocument/formatRange/validate JSON-RPC requests on '
+             'stdin/stdout for editor integrations'
+    )
+
+    parser.add_argument(
+        '--exclude',
+        action='append',
+        default=[],
+        metavar='PATTERN',
+        help='Skip files and directories matching PATTERN (.gitignore style) when '
+             'walking directories; repeatable. .git, vendor, node_modules and _site, '
+             'and whatever .gitignore and exclude: in _config.yml list, are always skipped'
+    )
+
+    parser.add_argument(
+        '--changed-since',
+        metavar='REF',
+        help='Only process Markdown files changed since REF (e.g. origin/main)'
+    )
+
+    parser.add_argument(
+        '--staged',
+        action='store_true',
+        help='Only process Markdown files staged in the git index (for pre-commit)'
+    )
+
+    parser.add_argument(
+        '--report',
+        choices=ReportWriter.FORMATS,
+        help='Stream a machine-readable report (one record per file, then a '
+             'summary) to stdout; other output goes to stderr'
+    )
+
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Report wall and CPU time per phase and the slowest files and diagrams'
+    )
+
+    parser.add_argument(
+        '--profile-top',
+        type=int,
+        default=10,
+        metavar='N',
+        help='Number of slowest files and diagrams shown by --profile (default: 10)'
+    )
+
+    parser.add_argument(
+        '--profile-out',
+        metavar='FILE',
+        help='Write a cProfile (pstats) dump of the run to FILE; '
+             'worker processes are not included, so use with --jobs 1'
+    )
+
+    parser.add_argument(
+        '--verbose', '-v',
+        action='store_true',
+        help='Verbose output'
+    )
+
+    args = parser.parse_args()
+
+    write = not args.dry_run and not args.validate
+
+    if args.fail_fast and not args.validate:
+        parser.error('--fail-fast requires --validate')
+
+    if args.report and (args.server or args.watch):
+        parser.error('--report cannot be combined with --server or --watch')
+
+    if args.lint and args.server:
+        parser.error('--lint cannot be combined with --server')
+
+    if args.server:
+        FormatServer(MarkdownProcessor(memo_size=args.memo_size)).serve()
+        return 0
+
+    if args.watch:
+        return run_watch(args, write)
+
+    if args.report:
+        # Keep stdout for the report; human-readable output goes to stderr
+        from contextlib import redirect_stdout
+
+        report = ReportWriter(args.report, sys.stdout)
+        with redirect_stdout(sys.stderr):
+            return run_batch(args, parser, write, report)
+    return run_batch(args, parser, write)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Mermaid Parser Fuzz and Timing Check
+
+Feeds format-mermaid.py pathological and random input and checks that:
+
+  - parsing a diagram takes time linear in the length of its lines: very
+    long labels, unbalanced quotes and brackets and huge whitespace runs
+    are timed at two sizes, and doubling the size may at most roughly
+    double the time
+  - formatting is idempotent: for random diagrams of each supported type
+    mixing valid statements and junk, format(format(x)) == format(x)
+
+Usage:
+    python fuzz-mermaid.py [options]
+
+Options:
+    --size N            Length of the pathological runs; each case is also
+                        timed at twice this size (default: 2000)
+    --max-growth X      Allowed time ratio between the two sizes (default: 3.0)
+    --budget-ms MS      Allowed parse time for any case at the larger size
+                        (default: 100)
+    --runs N            Timed runs per case; the fastest is used (default: 5)
+    --iterations N      Random diagrams for the idempotence check (default: 2000)
+    --seed N            Random seed (default: 1)
+"""
+
+import argparse
+import importlib.util
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+FORMATTER = Path(__file__).resolve().parent / 'format_mermaid.py'
+
+
+# =============================================================================
+# Pathological Input
+# =============================================================================
+
+def _ws(n: int) -> str:
+    return ' ' * n
+
+
+# One line each, built for a run length of n. Most are malformed on purpose:
+# a line that almost matches is what makes a backtracking regex retry every
+# way of splitting it.
+CASES: Dict[str, Callable[[int], str]] = {
+    'declaration':      lambda n: 'flowchart' + _ws(n) + 'x',
+    'comment':          lambda n: '%%' + _ws(n) + 'x',
+    'subgraph':         lambda n: 'subgraph A' + _ws(n) + '[' + _ws(n) + '!',
+    'subgraph_quote':   lambda n: 'subgraph A["' + 'x' * n,
+    'end':              lambda n: 'end' + _ws(n) + 'x',
+    'stadium':          lambda n: 'A([' + _ws(n) + 'x' + _ws(n) + '!',
+    'trapezoid':        lambda n: 'A[/' + _ws(n) + 'x' + _ws(n) + '!',
+    'trapezoid_rev':    lambda n: 'A[\\' + _ws(n) + 'x' + _ws(n) + '!',
+    'rectangle':        lambda n: 'A[' + _ws(n) + 'x' + _ws(n) + '] !',
+    'rectangle_quote':  lambda n: 'A["' + 'x' * n,
+    'long_label':       lambda n: 'A["' + 'Label ' * n + '"]',
+    'brackets':         lambda n: 'A' + '[' * n + ']' * (n - 1),
+    'long_id':          lambda n: 'A' * n + ' -',
+    'labeled_edge':     lambda n: 'A -->|' + _ws(n) + 'x' + _ws(n),
+    'dotted_edge':      lambda n: 'A -.' + _ws(n) + 'x' + _ws(n) + '.- B !',
+    'dotted_arrows':    lambda n: 'A -. ' + '.-' * n + ' !',
+    'quotes':           lambda n: 'A -. "' * n,
+    'simple_edge':      lambda n: 'A' + _ws(n) + '-->' + _ws(n) + 'B' + _ws(n) + '!',
+    'classdef':         lambda n: 'classDef c ' + _ws(n) + 'x' + _ws(n) + 'y',
+    'classdef_semis':   lambda n: 'classDef c x' + ';' * n + ' y',
+    'class':            lambda n: 'class a' + _ws(n) + 'b' + _ws(n) + '!',
+    'class_words':      lambda n: 'class ' + 'a ' * n + '!',
+    'linkstyle':        lambda n: 'linkStyle default' + _ws(n) + 'x' + _ws(n) + 'y',
+}
+
+
+def diagram_for(case: str, n: int) -> str:
+    """A diagram holding the pathological line for case."""
+    if case == 'init':
+        # Unterminated init blocks, searched over the whole diagram
+        return '%%{init: {' * n + '\nflowchart TB\n'
+    return f'flowchart TB\n{CASES[case](n)}\n'
+
+
+# =============================================================================
+# Random Diagrams
+# =============================================================================
+
+STATEMENTS = [
+    'A["Install"]', 'B([Start])', 'C[/"Input"/]', 'D[\\"Output"\\]', 'E[Plain label]',
+    'A --> B', 'A -->|"yes"| C', 'A -. "maybe" .- D', 'B <--> E', 'C -.-> A',
+    'subgraph S1["Group"]', 'subgraph S2', 'end', '%% comment', '%%{init: {"theme": "base"}}%%',
+    'classDef content fill:#fff,stroke:#F1D302;', 'class A,B content', 'linkStyle 0 stroke:#235789',
+    'linkStyle default stroke-width:2px',
+    # Block structure of the other diagram types
+    'loop Every minute', 'alt ok', 'else failed', 'par', 'and', 'A->>B: ping', 'Note over A: x',
+    'state A {', '[*] --> A', '--', 'note left of A', 'end note', 'note right of A : x',
+    'class A {', '+String name', 'namespace N {', '}', '---', 'title: x',
+]
+
+JUNK = [' ', '  ', '\t', 'A', 'W1', 'x', '_', '1', '"', '[', ']', '(', ')', '([', '])', '[/', '/]',
+        '[\\', '\\]', '|', '-', '.', '>', '<', ';', ',', ':', '{', '}', '%%', '-->', '-.', '.-',
+        '-.->', '---', 'TB', 'default', 'end', 'class', 'classDef', 'subgraph', 'linkStyle']
+
+
+def random_diagram(rng: random.Random) -> str:
+    """A diagram mixing valid statements, mangled statements and junk."""
+    lines = [rng.choice(['flowchart TB', 'flowchart LR', 'graph TD', 'sequenceDiagram',
+                         'stateDiagram-v2', 'classDiagram', ''])]
+    for _ in range(rng.randint(1, 12)):
+        roll = rng.random()
+        if roll < 0.5:
+            line = rng.choice(STATEMENTS)
+        elif roll < 0.8:
+            # Splice junk into a valid statement
+            line = rng.choice(STATEMENTS)
+            cut = rng.randint(0, len(line))
+            line = line[:cut] + ''.join(rng.choices(JUNK, k=rng.randint(1, 3))) + line[cut:]
+        else:
+            line = ''.join(rng.choices(JUNK, k=rng.randint(1, 10)))
+        lines.append(rng.choice(['', '  ', '    ', '\t']) + line)
+    return '\n'.join(lines)
+
+
+# =============================================================================
+# Checks
+# =============================================================================
+
+def load_formatter():
+    """Import the formatter module, format_mermaid.py."""
+    spec = importlib.util.spec_from_file_location('format_mermaid', FORMATTER)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def best_time(func: Callable[[], object], runs: int) -> float:
+    """Fastest of runs calls to func, in seconds."""
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def check_timing(fm, size: int, runs: int, max_growth: float, budget_ms: float) -> List[str]:
+    """Time every case at size and 2 * size; returns the failures."""
+    parser = fm.MermaidParser()
+    path = Path('fuzz.md')
+
+    def parse(content: str):
+        try:
+            parser.parse(content, path)
+        except ValueError:
+            pass  # Malformed linkStyle indices; the processor reports these
+
+    failures = []
+    print(f"{'Case':<18}{'n=' + str(size):>12}{'n=' + str(2 * size):>12}{'growth':>9}")
+    for case in [*CASES, 'init']:
+        small, large = diagram_for(case, size), diagram_for(case, 2 * size)
+        small_s = best_time(lambda: parse(small), runs)
+        large_s = best_time(lambda: parse(large), runs)
+        # Times below 50 us are too noisy for a ratio
+        growth = large_s / max(small_s, 50e-6)
+        flag = ''
+        if growth > max_growth:
+            flag = '  SUPERLINEAR'
+            failures.append(f"{case}: parse time grew {growth:.1f}x when the input doubled")
+        if large_s * 1000 > budget_ms:
+            flag += '  SLOW'
+            failures.append(f"{case}: {large_s * 1000:.1f} ms exceeds {budget_ms:g} ms budget")
+        print(f"{case:<18}{small_s * 1000:>10.3f}ms{large_s * 1000:>10.3f}ms{growth:>8.1f}x{flag}")
+    return failures
+
+
+def format_once(fm, content: str) -> Optional[str]:
+    """Format content the way the processor does; None if it is rejected."""
+    keyword, _ = fm.find_diagram_type(content)
+    plugin_class = fm.DIAGRAM_TYPES.get(keyword.lower())
+    if plugin_class is None:
+        return content  # Left untouched
+    try:
+        return '\n'.join(plugin_class().iter_lines(content, Path('fuzz.md')))
+    except Exception:
+        return None
+
+
+def check_idempotence(fm, iterations: int, seed: int) -> List[str]:
+    """Format random diagrams twice; returns the failures."""
+    rng = random.Random(seed)
+    failures = []
+    rejected = 0
+    for _ in range(iterations):
+        content = random_diagram(rng)
+        once = format_once(fm, content)
+        if once is None:
+            rejected += 1
+            continue
+        twice = format_once(fm, once)
+        if twice != once:
+            failures.append(f"not idempotent for {content!r}:\n"
+                            f"    once:  {once!r}\n    twice: {twice!r}")
+    print(f"\nIdempotence: {iterations} random diagrams (seed {seed}), "
+          f"{rejected} rejected by the parser, {len(failures)} failures")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Fuzz format-mermaid.py for superlinear parsing and non-idempotent output'
+    )
+    parser.add_argument('--size', type=int, default=2000,
+                        help='Length of the pathological runs (default: 2000)')
+    parser.add_argument('--max-growth', type=float, default=3.0,
+                        help='Allowed time ratio when the input doubles (default: 3.0)')
+    parser.add_argument('--budget-ms', type=float, default=100,
+                        help='Allowed parse time per case at the larger size (default: 100)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Timed runs per case; the fastest is used (default: 5)')
+    parser.add_argument('--iterations', type=int, default=2000,
+                        help='Random diagrams for the idempotence check (default: 2000)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    args = parser.parse_args()
+
+    fm = load_formatter()
+    failures = check_timing(fm, args.size, args.runs, args.max_growth, args.budget_ms)
+    failures += check_idempotence(fm, args.iterations, args.seed)
+
+    if failures:
+        for failure in failures[:10]:
+            print(f"\nFuzz check failed: {failure}")
+        if len(failures) > 10:
+            print(f"\n... and {len(failures) - 10} more")
+        return 1
+
+    print("\nFuzz check passed.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Mermaid Parser Parity Check
+
+Compares MermaidParser in the working tree against the one in a git
+revision of format_mermaid.py, for refactors of the parser that must not
+change its output:
+
+  - every diagram is parsed by both parsers and the resulting init block,
+    declaration and elements must be equal, field by field
+  - diagrams come from the Markdown files given (default: the site), from
+    generated flowcharts and from random lines of Mermaid tokens and junk
+  - the time per line of both parsers on a large generated flowchart is
+    reported
+
+Usage:
+    python parity-mermaid.py --against REV [options] [paths...]
+
+Options:
+    --against REV       Git revision to compare against, usually the one
+                        before the refactor (required)
+    --lines N           Random lines to compare (default: 100000)
+    --diagrams N        Generated flowcharts to compare (default: 200)
+    --size N            Elements in the timed flowchart (default: 50000)
+    --runs N            Timed runs; the fastest is used (default: 5)
+    --seed N            Random seed (default: 1)
+"""
+
+import argparse
+import importlib.util
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import fields
+from pathlib import Path
+from typing import Callable, List, Optional
+
+
+SCRIPTS = Path(__file__).resolve().parent
+FORMATTER = SCRIPTS / 'format-mermaid.py'
+MODULE = SCRIPTS / 'format_mermaid.py'
+BENCH = SCRIPTS / 'bench-mermaid.py'
+
+DEFAULT_PATHS = [str(SCRIPTS.parent / '_portfolio'), str(SCRIPTS.parent / 'docs')]
+
+# Fragments of Mermaid syntax, case and Unicode variants and junk; random
+# lines are built from these
+TOKENS = ['flowchart', 'graph', 'FLOWCHART', 'Graph', 'TB', 'LR', 'td', '%%', '%', 'subgraph',
+          'SUBGRAPH', 'ſubgraph', 'end', 'END', 'classDef', 'class', 'CLASS', 'linkStyle',
+          'default', 'A', 'B1', 'W2', '_x', 'é', '-->', '<-->', '-.->', '---', '-x->', '-.', '.-',
+          '<-.->', '|', '"', '[', ']', '(', ')', '([', '])', '[/', '/]', '[\\', '\\]', '{', '}',
+          ';', ',', ' ', '  ', '\t', '0', '1,2', 'fill:#fff', 'K', 'ß', '\r', '&', '>']
+
+
+# =============================================================================
+# Loading
+# =============================================================================
+
+def load_module(path: Path, name: str):
+    """Import a script as a module."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_revision(revision: str, directory: Path):
+    """Import the formatter module as of a git revision.
+
+    Revisions from before format_mermaid.py was split out have the whole
+    formatter in format-mermaid.py.
+    """
+    try:
+        source = subprocess.run(['git', 'show', f'{revision}:./{MODULE.name}'], cwd=SCRIPTS,
+                                capture_output=True, check=True).stdout
+    except subprocess.CalledProcessError:
+        source = subprocess.run(['git', 'show', f'{revision}:./{FORMATTER.name}'], cwd=SCRIPTS,
+                                capture_output=True, check=True).stdout
+    path = directory / 'format_mermaid_reference.py'
+    path.write_bytes(source)
+    return load_module(path, 'format_mermaid_reference')
+
+
+# =============================================================================
+# Comparison
+# =============================================================================
+
+def describe(element) -> Optional[dict]:
+    """An element's type and field values."""
+    if element is None:
+        return None
+    values = {f.name: getattr(element, f.name) for f in fields(element)}
+    values['type'] = type(element).__name__
+    return values
+
+
+def same(a: Optional[dict], b: Optional[dict]) -> bool:
+    """Compare two described elements on the fields both versions have."""
+    if a is None or b is None:
+        return a is b
+    return all(a[key] == b[key] for key in a.keys() & b.keys())
+
+
+def parse(parser, content: str):
+    """Describe the parse of content, or the exception it raised."""
+    try:
+        diagram = parser.parse(content, Path('parity.md'))
+    except Exception as e:
+        return ('error', type(e).__name__)
+    return [describe(diagram.init_block), describe(diagram.declaration),
+            *map(describe, diagram.elements)]
+
+
+def compare(current, reference, content: str) -> Optional[str]:
+    """None if both parsers agree on content, else a description."""
+    a, b = parse(current, content), parse(reference, content)
+    if isinstance(a, tuple) or isinstance(b, tuple):
+        agree = a == b
+    else:
+        agree = len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if agree:
+        return None
+    return f"{content!r}\n    working tree: {a!r}\n    reference:    {b!r}"
+
+
+def site_diagrams(fm, paths: List[str]) -> List[str]:
+    """The mermaid diagrams in the Markdown files under paths."""
+    processor = fm.MarkdownProcessor(memo_size=0)
+    return [block.content for path in fm.find_markdown_files(paths)
+            for block in processor.find_mermaid_blocks(path.read_text(encoding='utf-8'))]
+
+
+def random_line(rng: random.Random) -> str:
+    return ''.join(rng.choice(TOKENS) for _ in range(rng.randint(1, 8)))
+
+
+def check_parity(fm, ref, bench, paths: List[str], lines: int, diagrams: int,
+                 seed: int) -> List[str]:
+    """Compare both parsers on every input; returns the mismatches."""
+    current, reference = fm.MermaidParser(), ref.MermaidParser()
+    rng = random.Random(seed)
+    sources = {
+        'site diagrams': site_diagrams(fm, paths),
+        'generated flowcharts': [bench.scaling_diagram(rng.randint(10, 500), seed + i)
+                                 for i in range(diagrams)],
+        'random lines': [f"flowchart TB\n{random_line(rng)}" for _ in range(lines)],
+    }
+    failures = []
+    for name, contents in sources.items():
+        mismatches = [m for m in (compare(current, reference, c) for c in contents) if m]
+        print(f"{name:<22}{len(contents):>10,} compared{len(mismatches):>8,} mismatches")
+        failures += mismatches
+    return failures
+
+
+# =============================================================================
+# Timing
+# =============================================================================
+
+def best_time(func: Callable[[], object], runs: int) -> float:
+    """Fastest of runs calls to func, in seconds, with the GC paused."""
+    import gc
+
+    gc.collect()
+    gc.disable()
+    try:
+        best = float('inf')
+        for _ in range(runs):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+        return best
+    finally:
+        gc.enable()
+
+
+def time_per_line(fm, ref, bench, size: int, runs: int, seed: int):
+    """Print the parse time per line of both parsers on one large flowchart."""
+    content = bench.scaling_diagram(size, seed)
+    line_count = content.count('\n') + 1
+    path = Path('parity.md')
+    print(f"\nParse time per line ({line_count:,}-line flowchart):")
+    times = {}
+    for name, module in (('reference', ref), ('working tree', fm)):
+        parser = module.MermaidParser()
+        times[name] = best_time(lambda: parser.parse(content, path), runs) / line_count
+        print(f"  {name:<14}{times[name] * 1e6:>8.2f} us")
+    print(f"  {'speedup':<14}{times['reference'] / times['working tree']:>8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare the MermaidParser in the working tree against a git revision'
+    )
+    parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS,
+                        help='Markdown files or directories with diagrams to compare '
+                             '(default: _portfolio docs)')
+    parser.add_argument('--against', required=True, metavar='REV',
+                        help='Git revision to compare against, usually the one before '
+                             'the refactor')
+    parser.add_argument('--lines', type=int, default=100000,
+                        help='Random lines to compare (default: 100000)')
+    parser.add_argument('--diagrams', type=int, default=200,
+                        help='Generated flowcharts to compare (default: 200)')
+    parser.add_argument('--size', type=int, default=50000,
+                        help='Elements in the timed flowchart (default: 50000)')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Timed runs; the fastest is used (default: 5)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1)')
+    args = parser.parse_args()
+
+    fm = load_module(MODULE, 'format_mermaid')
+    bench = load_module(BENCH, 'bench_mermaid')
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            ref = load_revision(args.against, Path(tmp))
+        except subprocess.CalledProcessError as e:
+            print(f"Error: cannot read {FORMATTER.name} at {args.against}: "
+                  f"{e.stderr.decode(errors='replace').strip()}", file=sys.stderr)
+            return 2
+
+    print(f"Parity against {args.against}:")
+    failures = check_parity(fm, ref, bench, args.paths, args.lines, args.diagrams, args.seed)
+    time_per_line(fm, ref, bench, args.size, args.runs, args.seed)
+
+    if failures:
+        for failure in failures[:10]:
+            print(f"\nParity check failed: {failure}")
+        if len(failures) > 10:
+            print(f"\n... and {len(failures) - 10} more")
+        return 1
+
+    print("\nParity check passed.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())